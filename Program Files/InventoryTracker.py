@@ -1,18 +1,241 @@
-import time
+import argparse
+import csv
+import logging
 import os
+import re
+import threading
+import time
+from collections import Counter
+from startup import LazyResource
+from config import INVENTORY_PATH, INVENTORY_SYNC_EVERY, INVENTORY_SYNC_INTERVAL
 
-def CheckInventory(card):
-    file_path1="Collection/Collection.txt"
-    if not os.path.exists(file_path1):
-        with open(file_path1,'w'):
-            time.sleep(0.2)
-    if os.path.exists(file_path1):
-        with open(file_path1) as myfile:
-            if card in myfile.read():
-                print('Found card')
-                return ("RejectCard")
+logger = logging.getLogger(__name__)
+
+# Scryfall card ids, the keys of the collection
+CARD_ID_PATTERN = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
+class Inventory:
+    """Owned cards counted by card id in memory, persisted as an append-only journal.
+
+    Every journal line is "<card id>" (one copy added, the format of the old
+    Collection.txt) or "<card id> <count>" (count copies added, negative to
+    remove). Lines are flushed as they are written and fsynced in batches, every
+    sync_every lines or sync_interval seconds, so a crash of the program loses
+    nothing and a power cut at most the last batch.
+    """
+
+    def __init__(self, path=INVENTORY_PATH, sync_every=INVENTORY_SYNC_EVERY, sync_interval=INVENTORY_SYNC_INTERVAL):
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.lines = 0
+        self.pending = 0
+        self.last_sync = time.monotonic()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    entry = parse_entry(line)
+                    if entry is not None:
+                        self._apply(*entry)
+                        self.lines += 1
+        self.file = open(path, 'a', encoding='utf-8')
+        # Replaying a journal of mostly adds and removes of the same cards gets slow; fold it into one line per card
+        if self.lines > 2 * len(self.counts) + 1000:
+            self.compact()
+
+    def __contains__(self, card_id):
+        return self.counts.get(card_id, 0) > 0
+
+    def __len__(self):
+        """Distinct cards owned"""
+        return len(self.counts)
+
+    def count(self, card_id):
+        return self.counts.get(card_id, 0)
+
+    def total(self):
+        """Copies owned"""
+        return sum(self.counts.values())
+
+    def _apply(self, card_id, count):
+        count += self.counts.get(card_id, 0)
+        if count > 0:
+            self.counts[card_id] = count
+        else:
+            self.counts.pop(card_id, None)
+
+    def _write(self, entries):
+        for card_id, count in entries:
+            self.file.write(card_id + "\n" if count == 1 else f"{card_id} {count}\n")
+            self.lines += 1
+            self.pending += 1
+        self.file.flush()
+        if self.pending >= self.sync_every or time.monotonic() - self.last_sync >= self.sync_interval:
+            self._sync()
+
+    def _sync(self):
+        if self.pending:
+            os.fsync(self.file.fileno())
+            self.pending = 0
+        self.last_sync = time.monotonic()
+
+    def add(self, card_id, count=1):
+        with self.lock:
+            self._apply(card_id, count)
+            self._write([(card_id, count)])
+
+    def remove(self, card_id, count=1):
+        with self.lock:
+            count = min(count, self.counts.get(card_id, 0))
+            if count > 0:
+                self._apply(card_id, -count)
+                self._write([(card_id, -count)])
+
+    def add_if_new(self, card_id):
+        """Add one copy unless the card is already owned; True when it was added"""
+        with self.lock:
+            if self.counts.get(card_id, 0) > 0:
+                return False
+            self._apply(card_id, 1)
+            self._write([(card_id, 1)])
+            return True
+
+    def import_counts(self, counts):
+        """Add (card id, count) pairs in one batch; returns the copies added"""
+        entries = [(card_id, count) for card_id, count in counts if count > 0]
+        with self.lock:
+            for card_id, count in entries:
+                self._apply(card_id, count)
+            self._write(entries)
+            self._sync()
+        return sum(count for _, count in entries)
+
+    def export(self, path):
+        """Write the collection as "<count> <card id>" lines, or id,count rows for a .csv path"""
+        with self.lock:
+            items = sorted(self.counts.items())
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            if path.lower().endswith(".csv"):
+                writer = csv.writer(f)
+                writer.writerow(["id", "count"])
+                writer.writerows(items)
             else:
-                with open(file_path1,"a") as file1:
-                    file1.write(card + "\n")
-                    print('Not found, added to your collection list')
-                    return (card)
+                f.writelines(f"{count} {card_id}\n" for card_id, count in items)
+        return len(items)
+
+    def compact(self):
+        """Rewrite the journal as one line per owned card"""
+        with self.lock:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.writelines(card_id + "\n" if count == 1 else f"{card_id} {count}\n"
+                             for card_id, count in sorted(self.counts.items()))
+                f.flush()
+                os.fsync(f.fileno())
+            self.file.close()
+            os.replace(tmp_path, self.path)
+            self.file = open(self.path, 'a', encoding='utf-8')
+            self.lines = len(self.counts)
+            self.pending = 0
+
+    def close(self):
+        with self.lock:
+            self._sync()
+            self.file.close()
+
+def parse_entry(line):
+    """(card id, count) of a journal or collection list line: "id", "id count", "count id" or "countx id" """
+    parts = line.replace(",", " ").split()
+    if not parts or len(parts) > 2:
+        return None
+    if len(parts) == 1:
+        return parts[0], 1
+    first, second = parts[0], parts[1]
+    if first.rstrip("xX").lstrip("-").isdigit():
+        return second, int(first.rstrip("xX"))
+    if second.lstrip("-").isdigit():
+        return first, int(second)
+    return first, 1
+
+def is_card_id(text):
+    return CARD_ID_PATTERN.fullmatch(text) is not None
+
+def read_collection_list(path):
+    """(card id, count) pairs of a collection list: text lines as in parse_entry, or a CSV with an id column.
+
+    Lines that hold no Scryfall card id (e.g. "4 Lightning Bolt") are reported and skipped.
+    """
+    skipped = 0
+    with open(path, 'r', newline='', encoding='utf-8-sig') as f:
+        if path.lower().endswith(".csv"):
+            reader = csv.DictReader(f)
+            fields = {name.lower().strip(): name for name in reader.fieldnames or []}
+            id_field = fields.get("scryfall_id") or fields.get("scryfall id") or fields.get("id")
+            count_field = fields.get("count") or fields.get("quantity") or fields.get("qty")
+            if id_field is None:
+                raise ValueError(f"{path} has no id or scryfall_id column")
+            rows = ((reader.line_num, row[id_field], row[count_field] if count_field else "1") for row in reader)
+            entries = ((line_number, (card_id or "").strip().lower(), count)
+                       for line_number, card_id, count in rows)
+        else:
+            entries = ((line_number, line.strip(), None) for line_number, line in enumerate(f, 1))
+        for line_number, text, count in entries:
+            if not text or text.startswith("#"):
+                continue
+            try:
+                entry = parse_entry(text) if count is None else (text, int(count or 1))
+            except ValueError:
+                entry = None
+            if entry is None or not is_card_id(entry[0].lower()):
+                print(f"Skipping line {line_number} of {path}, no card id: {text[:60]}")
+                skipped += 1
+                continue
+            yield entry[0].lower(), entry[1]
+    if skipped:
+        print(f"Skipped {skipped} lines of {path} without a card id.")
+
+def load_inventory():
+    inventory = Inventory()
+    print(f"Opened collection {inventory.path} with {inventory.total()} cards ({len(inventory)} distinct).")
+    return inventory
+
+INVENTORY = LazyResource("inventory", load_inventory)
+
+def CheckInventory(card):
+    """Reject a card (id) that is already in the collection, otherwise add it and return it"""
+    if not INVENTORY.get().add_if_new(card):
+        print('Found card')
+        return ("RejectCard")
+    print('Not found, added to your collection list')
+    return (card)
+
+def main():
+    parser = argparse.ArgumentParser(description="Import, export or compact the card collection")
+    parser.add_argument("command", choices=["import", "export", "compact", "stats"])
+    parser.add_argument("path", nargs="?", help="Collection list to import or file to export to (.csv or text)")
+    args = parser.parse_args()
+    if args.command in ("import", "export") and not args.path:
+        parser.error(f"{args.command} needs a path")
+
+    inventory = INVENTORY.get()
+    try:
+        if args.command == "import":
+            added = inventory.import_counts(read_collection_list(args.path))
+            print(f"Imported {added} cards from {args.path}.")
+        elif args.command == "export":
+            print(f"Exported {inventory.export(args.path)} distinct cards to {args.path}.")
+        elif args.command == "compact":
+            inventory.compact()
+            print(f"Compacted {inventory.path} to {len(inventory)} lines.")
+        elif args.command == "stats":
+            print(f"Distinct cards: {len(inventory)} | Total cards: {inventory.total()} | "
+                  f"Journal lines: {inventory.lines}")
+    finally:
+        inventory.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,53 +1,66 @@
 #Imports
+import startup
+import argparse
 import cv2
 import logging
-import serial
+import queue
 import sys
+import threading
 import time
+import detectname
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
 from PIL import Image
-from ultralytics import YOLO
-from cards import extract_card_info, CARD_DATA_BY_ID
-from config import CROP_SIZE, SORTING_MODES, EXCLUDED_SETS, SERIAL_PORT, BAUD_RATE, START_MARKER, END_MARKER, MAX_ATTEMPTS_NAME, TIMEOUT_NAME
-from detection import find_card_contour, get_perspective_corrected_card
-from detectname import find_text, compare_strings
-from hashing import hash_image_color, compute_distances_for_image
-from InventoryTracker import CheckInventory
+from cards import CARD_STORE, NAME_INDEX, extract_card_info
+from config import CROP_SIZE, DETECTION_MODE, SORTING_MODES, MAX_DISTANCE_THRESHOLD, SERIAL_PORT, BAUD_RATE, START_MARKER, END_MARKER, SERIAL_QUEUE_SIZE, SERIAL_READY_TIMEOUT, MAX_ATTEMPTS_NAME, TIMEOUT_NAME, NAME_INDEX_ENABLED, NAME_MATCH_LIMIT, NAME_MATCH_MIN_SCORE, CARD_TRACKING_ENABLED, RECOGNITION_MODE, OCR_TASK_TIMEOUT, HASH_TASK_TIMEOUT, PIPELINE_ENABLED, PIPELINE_QUEUE_SIZE, PIPELINE_STATS_INTERVAL, METRICS_PATH, METRICS_FORMAT, METRICS_INTERVAL
+from detection import CardTracker, find_card_contour, get_perspective_corrected_card, search_roi_around
+from detectname import OCR_CACHE, OCR_READER, cached_text, find_text, compare_strings
+from framesource import open_source
+from hashing import HASH_SEARCH, candidate_rows, hash_orientations, is_decisive_match, recognize_card
+from InventoryTracker import INVENTORY, CheckInventory
+from metrics import METRICS
+from pipeline import BoundedQueue, Pipeline, STOP
+from results import CardResults
+from seriallink import SerialLink
 from sorting import print_sorting_options, draw_info_as_json, get_bin_number, get_name
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 logging.getLogger("ultralytics").setLevel(logging.WARNING)
+startup.mark("imports")
+
+# Workers for concurrent recognition; a third absorbs a cancelled OCR task still finishing its attempt
+RECOGNITION_POOL = ThreadPoolExecutor(max_workers=3, thread_name_prefix="recognize")
+link = None
+# Set by --headless: no OpenCV windows or key polling, for replays and profiling
+HEADLESS = False
+
+def show(window, image):
+    if not HEADLESS:
+        cv2.imshow(window, image)
+
+def quit_requested():
+    return not HEADLESS and cv2.waitKey(1) & 0xFF == ord('q')
 
 def init_serial():
-    global ser
-    ser = serial.Serial(SERIAL_PORT, BAUD_RATE)
+    global link
+    link = SerialLink(SERIAL_PORT, BAUD_RATE, bytes([START_MARKER]), bytes([END_MARKER]),
+                      queue_size=SERIAL_QUEUE_SIZE, ready_timeout=SERIAL_READY_TIMEOUT, on_message=machine_message).start()
     print(f"Serial port {SERIAL_PORT} opened. Baudrate {BAUD_RATE}.")
     wait_for_arduino()
 
+def machine_message(message):
+    if link.ready_text in message:
+        DISPATCH.machine_ready()
+
 def send_to_arduino(send_str):
+    # Returns as soon as the command is queued; the link sends it when the machine is ready
     if send_str:
-        ser.write(send_str.encode('utf-8'))
-        wait_for_arduino()
-
-def recv_from_arduino():
-    ck = ""
-    x = "z"
-    while ord(x) != START_MARKER:
-        x = ser.read()
-    while ord(x) != END_MARKER:
-        if ord(x) != START_MARKER:
-            ck += x.decode("utf-8")
-        x = ser.read()
-    return ck
+        link.send(send_str)
 
 def wait_for_arduino():
-    msg = ""
-    while "Arduino is ready" not in msg:
-        while ser.in_waiting == 0:
-            pass
-        msg = recv_from_arduino()
-        print(msg)
+    while not link.wait_ready(SERIAL_READY_TIMEOUT):
+        logger.warning(f"Still waiting for the Arduino on {SERIAL_PORT}")
 
 def handle_unrecognized_card(display_frame, card_approx, reason="Unknown"):
     start_time = time.time()
@@ -55,23 +68,33 @@ def handle_unrecognized_card(display_frame, card_approx, reason="Unknown"):
     cv2.putText(display_frame, "Unrecognized Card", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
     cv2.putText(display_frame, f"Reason: {reason}", (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
     cv2.putText(display_frame, "Bin: 33", (10, 200), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-    cv2.imshow("Detected Card", display_frame)
-    logger.info(f"Card unrecognized: {reason} | Processing time: {time.time() - start_time:.3f}s")
+    METRICS.count("cards_rejected_total")
+    METRICS.observe("handle_card_seconds", time.time() - start_time)
+    logger.info(f"Card unrecognized: {reason}")
     #send_to_arduino("RejectCard")
+    return "RejectCard"
 
-def handle_recognized_card(display_frame, chosen_info, current_sorting_mode, threshold, choice2, name2):
+def handle_recognized_card(display_frame, chosen_id, chosen_info, current_sorting_mode, threshold, choice2, name2, verified=False):
     start_time = time.time()
     draw_info_as_json(display_frame, chosen_info, start_x=10, start_y=30, line_height=20)
-    if choice2 == "Y":
-        chosen_info = CheckInventory(chosen_info)
     name = get_name(chosen_info)
     similarity = 0.0
     similarity = compare_strings(name,name2)
-    card_result = get_bin_number(chosen_info, current_sorting_mode, threshold)
+    if not verified and similarity < 0.6:
+        # Nothing is forwarded, so the card is not sorted (nor added to the inventory)
+        card_result = None
+    elif choice2 == "Y" and CheckInventory(chosen_id) == "RejectCard":
+        # Already in the collection
+        card_result = "RejectCard"
+    else:
+        card_result = get_bin_number(chosen_info, current_sorting_mode, threshold)
     cv2.putText(display_frame, f"Bin: {card_result}", (10, 200),
                 cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-    cv2.imshow("Detected Card", display_frame)
-    if similarity >= 0.6:
+    if verified:
+        print(f"Decisive hash match for {name}, forwarding to Arduino without a name check.")
+        time.sleep(0.1)
+        #send_to_arduino(card_result)
+    elif similarity >= 0.6:
         print(f"Similarity: {similarity} Name: {name} and Name2:{name2} and Similarity: {similarity})")
         print("Similarity was good, forwarding to Arduino.")
         time.sleep(0.1)
@@ -79,131 +102,490 @@ def handle_recognized_card(display_frame, chosen_info, current_sorting_mode, thr
     else:
         print(f"Similarity: {similarity} Name: {name} and Name2:{name2} and Similarity: {similarity})")
         print("Similarity was too low")
-    logger.info(f"Card recognized | Total processing time: {time.time() - start_time:.3f}s")
+    METRICS.count("cards_sorted_total" if card_result is not None else "cards_unsorted_total")
+    METRICS.observe("handle_card_seconds", time.time() - start_time)
+    logger.debug(f"Card recognized | Total processing time: {time.time() - start_time:.3f}s")
+    return card_result
+
+def handle_card_result(display_frame, card_approx, name, chosen_id, chosen_info, current_sorting_mode, threshold, choice2, verified=False):
+    """Sort the card when it was matched and its name read (or the match alone is decisive), else reject it.
+
+    Returns the bin the card was sent to, or None when it was not sorted.
+    """
+    if chosen_info and (name is not None or verified):
+        return handle_recognized_card(display_frame, chosen_id, chosen_info, current_sorting_mode, threshold, choice2, name, verified)
+    elif name is None:
+        return handle_unrecognized_card(display_frame, card_approx, reason="Name not found")
+    else:
+        return handle_unrecognized_card(display_frame, card_approx, reason="Card data not found")
 
-def process_card_approx(frame, card_approx, current_sorting_mode, threshold, choice2):
+def name_candidate_rows(name):
+    """Hash index rows of the printings of the OCR'd name, or None to search every card"""
+    if not NAME_INDEX_ENABLED or not name:
+        return None
+    card_ids = NAME_INDEX.get().card_ids(name, NAME_MATCH_LIMIT, NAME_MATCH_MIN_SCORE)
+    if not card_ids:
+        logger.info(f"Name '{name}' not in the name index, searching every card")
+        return None
+    rows = candidate_rows(card_ids)
+    return rows if len(rows) else None
+
+def process_card_approx(frame, card_approx, current_sorting_mode, threshold, choice2, name=None, queries=None):
+    """Match the card's hash over every card, or first over the printings of name.
+
+    queries (the queries of an earlier Recognition of this card) skips warping
+    and hashing the crop again.
+    """
     start_time = time.time()
-    warped = get_perspective_corrected_card(frame, card_approx)
-    warp_time = time.time()
-    cropped_upright = warped[:CROP_SIZE, :CROP_SIZE]
-    img_pil_upright = Image.fromarray(cv2.cvtColor(cropped_upright, cv2.COLOR_BGR2RGB))
-    rotated180 = cv2.rotate(warped, cv2.ROTATE_180)
-    cropped_rotated = rotated180[:CROP_SIZE, :CROP_SIZE]
-    img_pil_rotated = Image.fromarray(cv2.cvtColor(cropped_rotated, cv2.COLOR_BGR2RGB))
-    crop_rotate_time = time.time()
-    
-    upright_id, upright_dist = hash_image_color(img_pil_upright, hash_size=16)
-    rotated_id, rotated_dist = hash_image_color(img_pil_rotated, hash_size=16)
-    hash_time = time.time()
-    
-    all_distances = compute_distances_for_image(img_pil_upright, hash_size=16)
-    distance_time = time.time()
-    
-    allowed_distances = [(cid, dist) for cid, dist in all_distances
-                         if CARD_DATA_BY_ID.get(cid, {}).get('set', '').lower() not in EXCLUDED_SETS]
-    allowed_distances.sort(key=lambda x: x[1])
-    sort_time = time.time()
-    
-    logger.info(f"Card processing times - Warp: {warp_time-start_time:.3f}s, Crop/Rotate: {crop_rotate_time-warp_time:.3f}s, "
-                f"Hashing: {hash_time-crop_rotate_time:.3f}s, Distance: {distance_time-hash_time:.3f}s, "
-                f"Sort: {sort_time-distance_time:.3f}s, Total: {sort_time-start_time:.3f}s")
-    
-    if allowed_distances:
-        chosen_id = allowed_distances[0][0]
-        chosen_info = extract_card_info(chosen_id)
-        return chosen_id, chosen_info
-    return None, None
+    if queries is None:
+        warped = get_perspective_corrected_card(frame, card_approx)
+        warp_time = time.time()
+        cropped_upright = warped[:CROP_SIZE, :CROP_SIZE]
+        img_pil_upright = Image.fromarray(cv2.cvtColor(cropped_upright, cv2.COLOR_BGR2RGB))
+        rotated180 = cv2.rotate(warped, cv2.ROTATE_180)
+        cropped_rotated = rotated180[:CROP_SIZE, :CROP_SIZE]
+        img_pil_rotated = Image.fromarray(cv2.cvtColor(cropped_rotated, cv2.COLOR_BGR2RGB))
+        crop_rotate_time = time.time()
+        # Hashed once; the name-restricted scan and its fallback share the words
+        queries = hash_orientations({"upright": img_pil_upright, "rotated": img_pil_rotated})
+        METRICS.observe("warp_seconds", warp_time - start_time)
+        METRICS.observe("crop_rotate_seconds", crop_rotate_time - warp_time)
+    else:
+        warp_time = crop_rotate_time = start_time
+
+    rows = name_candidate_rows(name)
+    match = recognize_card(queries=queries, rows=rows)
+    if rows is not None and match.card_id is None:
+        # The name was misread as another real card; the full scan still finds the right one
+        logger.info(f"No printing of '{name}' within distance {MAX_DISTANCE_THRESHOLD}, searching every card")
+        match = recognize_card(queries=queries)
+    match_time = time.time()
 
-def detect_card_name(frame, card_approx):
+    METRICS.observe("hash_match_seconds" if rows is None else "hash_match_by_name_seconds", match_time - crop_rotate_time)
+    METRICS.observe("card_processing_seconds", match_time - start_time)
+    logger.debug(f"Card processing times - Warp: {warp_time-start_time:.3f}s, Crop/Rotate: {crop_rotate_time-warp_time:.3f}s, "
+                 f"Hash/Match: {match_time-crop_rotate_time:.3f}s ({'all cards' if rows is None else f'{len(rows)} printings'}), "
+                 f"Total: {match_time-start_time:.3f}s")
+
+    if match.card_id is None:
+        logger.info(f"No card within distance {MAX_DISTANCE_THRESHOLD}")
+        return None, None, match
+    logger.info(f"Best match {match.card_id} ({match.orientation}) | Distance: {match.distance:.1f} | "
+                f"Margin: {match.margin:.1f}")
+    chosen_info = extract_card_info(match.card_id)
+    return match.card_id, chosen_info, match
+
+def detect_card_name(frame, card_approx, next_frame=None, cancel=None):
+    """Read the card name, stopping as soon as two readings agree or the OCR cache already knows the title.
+
+    next_frame supplies a fresh camera frame for each further attempt; without
+    it a single reading is made, since OCR on the same image gives the same text.
+    Setting the cancel event stops the search before the next attempt.
+    """
     start_time = time.time()
+    # A title strip whose name was confirmed before needs no OCR at all
+    cache_key, name = cached_text(frame, card_approx)
+    if name is not None:
+        METRICS.count("ocr_cache_hits_total")
+        METRICS.observe("name_detection_seconds", time.time() - start_time)
+        logger.debug(f"Name {name} from the OCR cache | {OCR_CACHE.stats()}")
+        return name
     namearray = []
     attempts = 0
-    start_time_outer = time.time()
-    while len(namearray) < 2 and attempts < MAX_ATTEMPTS_NAME and time.time() - start_time_outer < TIMEOUT_NAME:
-        attempt_start = time.time()
-        time.sleep(0.1)
-        text_found = find_text(frame, card_approx)
+    while attempts < MAX_ATTEMPTS_NAME and time.time() - start_time < TIMEOUT_NAME:
+        if cancel is not None and cancel.is_set():
+            logger.info(f"Name detection cancelled after {attempts} attempts")
+            return None
+        with METRICS.timer("ocr_attempt_seconds"):
+            text_found = find_text(frame, card_approx)
         attempts += 1
+        METRICS.count("ocr_attempts_total")
         if text_found:
             namearray.append(text_found)
-        logger.debug(f"Name detection attempt {attempts} took {time.time() - attempt_start:.3f}s")
+            if namearray.count(text_found) >= 2:
+                break
+        if next_frame is None or (cancel is not None and cancel.is_set()):
+            break
+        frame = next_frame()
+        if frame is None:
+            break
     
+    METRICS.observe("name_detection_seconds", time.time() - start_time)
     if len(namearray) < 1:
-        logger.warning(f"Could not find name. Total time: {time.time() - start_time_outer:.3f}s")
+        METRICS.count("names_not_found_total")
+        logger.warning(f"Could not find name. Total time: {time.time() - start_time:.3f}s")
         return None
     else:
         text_counts = Counter(namearray)
-        name = text_counts.most_common(1)[0][0]
-        logger.info(f"Name detection completed in {time.time() - start_time:.3f}s | "
-                   f"Total attempts: {attempts} | Best name: {name}")
+        name, readings = text_counts.most_common(1)[0]
+        # Only names two readings agree on are cached, so a misread is never served again
+        if readings >= 2 and cache_key is not None:
+            OCR_CACHE.put(cache_key, name)
+        logger.debug(f"Name detection completed in {time.time() - start_time:.3f}s | "
+                     f"Total attempts: {attempts} | Best name: {name} | {OCR_CACHE.stats()}")
         return name
 
-def main():
-    # Initialize serial, sorting options, etc.
-    # init_serial()
-    print_sorting_options()
-    choice = input("Enter the number of the sorting method: ").strip()
-    choice2 = input("Track inventory (Option unfinished)? (Y/N): ").strip() if choice in ["3", "6"] else "N"
-    current_sorting_mode = SORTING_MODES.get(choice, "color")
-    threshold = input("Enter a price threshold: ").strip() if current_sorting_mode == "buy" else 1000000
-    
-    cap = cv2.VideoCapture(0)
-    if not cap.isOpened():
-        logger.error("Cannot open webcam.")
-        sys.exit(1)
+def recognize_concurrently(frame, card_approx, current_sorting_mode, threshold, choice2, next_frame=None):
+    """Read the name and match the hash side by side, so a card costs max(OCR, hash) rather than the sum.
+
+    Returns (name, chosen_id, chosen_info, verified). A decisive hash match cancels the OCR
+    task and is returned as verified; otherwise the name is awaited and, when
+    it disagrees with the match, used to search only that name's printings.
+    """
+    cancel = threading.Event()
+    ocr_task = RECOGNITION_POOL.submit(detect_card_name, frame, card_approx, next_frame, cancel)
+    hash_task = RECOGNITION_POOL.submit(process_card_approx, frame, card_approx, current_sorting_mode, threshold, choice2)
+    chosen_id, chosen_info, match = None, None, None
+    try:
+        chosen_id, chosen_info, match = hash_task.result(timeout=HASH_TASK_TIMEOUT)
+    except FuturesTimeout:
+        logger.warning(f"Hash matching timed out after {HASH_TASK_TIMEOUT}s")
+    except Exception as e:
+        logger.exception(f"Hash matching failed: {e}")
+
+    if chosen_info and is_decisive_match(match):
+        cancel.set()
+        name = ocr_task.result() if ocr_task.done() else None
+        logger.info(f"Decisive hash match (distance {match.distance:.1f}, margin {match.margin:.1f}), "
+                    f"{'OCR already done' if name else 'OCR cancelled'}")
+        return name, chosen_id, chosen_info, True
+
+    try:
+        name = ocr_task.result(timeout=OCR_TASK_TIMEOUT)
+    except FuturesTimeout:
+        cancel.set()
+        logger.warning(f"Name detection timed out after {OCR_TASK_TIMEOUT}s")
+        name = None
+    queries = match.queries if match is not None else None
+    return (name, *confirm_with_name(frame, card_approx, chosen_id, chosen_info, name, current_sorting_mode, threshold, choice2, queries), False)
+
+def recognize_hash_first(frame, card_approx, current_sorting_mode, threshold, choice2, next_frame=None):
+    """Match the hash first and pay for OCR only when the match is ambiguous or distant.
+
+    Returns (name, chosen_id, chosen_info, verified) like recognize_concurrently.
+    """
+    chosen_id, chosen_info, match = process_card_approx(frame, card_approx, current_sorting_mode, threshold, choice2)
+    if chosen_info and is_decisive_match(match):
+        logger.info(f"Decisive hash match (distance {match.distance:.1f}, margin {match.margin:.1f}), skipping OCR")
+        return None, chosen_id, chosen_info, True
+    name = detect_card_name(frame, card_approx, next_frame)
+    return (name, *confirm_with_name(frame, card_approx, chosen_id, chosen_info, name, current_sorting_mode, threshold, choice2, match.queries), False)
+
+def recognize_ocr_first(frame, card_approx, current_sorting_mode, threshold, choice2, next_frame=None):
+    """Read the name, then match the hash over that name's printings"""
+    name = detect_card_name(frame, card_approx, next_frame)
+    chosen_id, chosen_info = None, None
+    if name is not None:
+        chosen_id, chosen_info, _ = process_card_approx(frame, card_approx, current_sorting_mode, threshold, choice2, name)
+    return name, chosen_id, chosen_info, False
+
+def confirm_with_name(frame, card_approx, chosen_id, chosen_info, name, current_sorting_mode, threshold, choice2, queries=None):
+    """Repeat a match that disagrees with the OCR'd name over that name's printings only.
+
+    queries are the hashed orientations of the first match, reused instead of hashing the crop again.
+    """
+    if name is not None and chosen_info and NAME_INDEX_ENABLED and compare_strings(get_name(chosen_info), name) < 0.6:
+        chosen_id, chosen_info, _ = process_card_approx(frame, card_approx, current_sorting_mode, threshold, choice2, name, queries)
+    return chosen_id, chosen_info
+
+RECOGNIZERS = {
+    "ocr_first": recognize_ocr_first,
+    "hash_first": recognize_hash_first,
+    "concurrent": recognize_concurrently,
+}
+
+def recognize(frame, card_approx, current_sorting_mode, threshold, choice2, next_frame=None):
+    """Recognize a card with the configured RECOGNITION_MODE and log how often OCR was skipped"""
+    recognizer = RECOGNIZERS.get(RECOGNITION_MODE, recognize_ocr_first)
+    with METRICS.timer("recognition_seconds"):
+        name, chosen_id, chosen_info, verified = recognizer(frame, card_approx, current_sorting_mode, threshold, choice2, next_frame)
+    METRICS.count("cards_total")
+    METRICS.count("ocr_skipped_total", int(verified))
+    cards, skipped = METRICS.value("cards_total"), METRICS.value("ocr_skipped_total")
+    logger.debug(f"OCR skipped for {skipped} of {cards} cards ({skipped / cards:.0%})")
+    return name, chosen_id, chosen_info, verified
+
+def record_card(results, origin, detected_at, name, chosen_id, chosen_info, verified, card_bin):
+    """Add a card to the run's results; origin is FrameSource.origin() of the frame it was found in"""
+    results.record(**origin, name=name, card_id=chosen_id, card_name=get_name(chosen_info) if chosen_info else None,
+                   set=chosen_info.get("Set") if chosen_info else None, verified=bool(verified), bin=card_bin,
+                   latency=round(time.perf_counter() - detected_at, 4))
+
+def track_card(tracker, frame):
+    """Contour of a newly arrived, settled card, or None while it is absent or already handled"""
+    if tracker is None:
+        return find_card_contour(frame)
+    card_approx = None
+    if tracker.last is not None and DETECTION_MODE == "pyramid":
+        card_approx = find_card_contour(frame, search_roi_around(tracker.last, frame.shape))
+    if card_approx is None:
+        card_approx = find_card_contour(frame)
+    return tracker.update(card_approx)
+
+class DispatchWatch:
+    """When a sorted card was last taken away, so the CardTracker can start over for the next one.
+
+    Cards fed back to back from the stack sit at the same place and size, so
+    the tracker would otherwise take them for the one card, which never left.
+    A fed replay swaps in the next image as soon as a card is dispatched; the
+    Arduino has moved a card once it reports ready after the command. Without
+    either, the tracker waits for the card to leave the frame as before.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.moved_at = 0.0
+        self.reset_for = 0.0
+        self.waiting = 0  # Dispatched cards the machine has not reported moved yet
+
+    def dispatched(self, cap, origin):
+        with self.lock:
+            if cap.card_dispatched(origin):
+                self.moved_at = time.perf_counter()
+            elif link is not None:
+                self.waiting += 1
+
+    def machine_ready(self):
+        with self.lock:
+            if self.waiting:
+                self.waiting -= 1
+                self.moved_at = time.perf_counter()
+
+    def reset_if_moved(self, tracker, captured_at):
+        """Reset the tracker at the first frame captured after the card was taken away"""
+        with self.lock:
+            if tracker is None or self.moved_at <= self.reset_for or captured_at < self.moved_at:
+                return
+            self.reset_for = self.moved_at
+        tracker.reset()
+
+DISPATCH = DispatchWatch()
+
+def run_sequential(cap, current_sorting_mode, threshold, choice2, results):
+    tracker = CardTracker() if CARD_TRACKING_ENABLED else None
+    # The OCR worker may read fresh frames while a cancelled attempt winds down
+    capture_lock = threading.Lock()
+
+    def read_frame():
+        with capture_lock:
+            return cap.read()
 
-    frame_count = 0
-    total_processing_time = 0
-    
     while True:
         frame_start = time.time()
-        ret, frame = cap.read()
+        captured_at = time.perf_counter()
+        ret, frame = read_frame()
         if not ret:
-            logger.error("Failed to grab frame.")
+            if cap.exhausted:
+                logger.info("End of frame source.")
+            else:
+                logger.error("Failed to grab frame.")
             break
+        origin = cap.origin()
 
         # Show the original camera feed in a window
-        cv2.imshow("Camera Feed", frame)
+        show("Camera Feed", frame)
 
-        # Find card contour in the current frame
-        card_approx = find_card_contour(frame)
+        # Find the card contour, once per card arrival
+        DISPATCH.reset_if_moved(tracker, captured_at)
+        card_approx = track_card(tracker, frame)
 
         # Always display the current frame with overlays
         display_frame = frame.copy()
 
         if card_approx is not None:
-            # Detect card name in the current frame
-            name = detect_card_name(frame, card_approx)
-
-            if name is None:
-                handle_unrecognized_card(display_frame, card_approx, reason="Name not found")
-            else:
-                # Process the card approximation for recognition
-                chosen_id, chosen_info = process_card_approx(frame, card_approx, current_sorting_mode, threshold, choice2)
-                if chosen_info:
-                    handle_recognized_card(display_frame, chosen_info, current_sorting_mode, threshold, choice2, name)
-                else:
-                    handle_unrecognized_card(display_frame, card_approx, reason="Card data not found")
-            
+            detected_at = time.perf_counter()
+            # Recognize the card, reading fresh frames for further name detection attempts
+            name, chosen_id, chosen_info, verified = recognize(frame, card_approx, current_sorting_mode, threshold, choice2,
+                                                               next_frame=lambda: read_frame()[1])
+            card_bin = handle_card_result(display_frame, card_approx, name, chosen_id, chosen_info, current_sorting_mode, threshold, choice2, verified)
+            record_card(results, origin, detected_at, name, chosen_id, chosen_info, verified, card_bin)
+            DISPATCH.dispatched(cap, origin)
+        
             # Show the detection result with overlays
-            cv2.imshow("Detected Card", display_frame)
+            show("Detected Card", display_frame)
         else:
             # If no card found, just show the original frame
-            cv2.imshow("Detected Card", display_frame)
+            show("Detected Card", display_frame)
 
         # Frame timing and stats
-        frame_count += 1
-        total_processing_time += time.time() - frame_start
-        avg_time = total_processing_time / frame_count if frame_count > 0 else 0
-        logger.info(f"Frame {frame_count} processed in {time.time() - frame_start:.3f}s | "
-                    f"Avg frame time: {avg_time:.3f}s")
+        METRICS.count("frames_total")
+        METRICS.observe("frame_seconds", time.time() - frame_start)
 
         # Exit condition
-        if cv2.waitKey(1) & 0xFF == ord('q'):
+        if quit_requested():
             break
 
+def run_pipeline(cap, current_sorting_mode, threshold, choice2, results):
+    """Capture, detection, OCR, hash matching and actuation on their own threads"""
+    detectname.SHOW_ROI = False  # OpenCV windows may only be touched from the main thread
+    stop_event = threading.Event()
+    tracker = CardTracker() if CARD_TRACKING_ENABLED else None
+    # Only a live source outruns the pipeline; a replay waits so that no frame is lost
+    frames = BoundedQueue(PIPELINE_QUEUE_SIZE, drop_oldest=cap.live)
+    # A tracked card is emitted only once, so it must not be dropped as stale
+    detected = BoundedQueue(PIPELINE_QUEUE_SIZE, drop_oldest=not CARD_TRACKING_ENABLED)
+    named = BoundedQueue(PIPELINE_QUEUE_SIZE)
+    matched = BoundedQueue(PIPELINE_QUEUE_SIZE)
+    display = BoundedQueue(4 * PIPELINE_QUEUE_SIZE, drop_oldest=True)
+    latest = {"frame": None, "ready": threading.Condition()}
+
+    def capture(_):
+        if stop_event.is_set():
+            return STOP
+        captured_at = time.perf_counter()
+        ret, frame = cap.read()
+        if not ret:
+            if cap.exhausted:
+                logger.info("End of frame source.")
+            else:
+                logger.error("Failed to grab frame.")
+            return STOP
+        with latest["ready"]:
+            latest["frame"] = frame
+            latest["ready"].notify_all()
+        display.put(("Camera Feed", frame))
+        return {"frame": frame, "origin": cap.origin(), "captured_at": captured_at}
+
+    def fresh_frame(previous):
+        """Wait briefly for a capture newer than previous, for another OCR attempt"""
+        with latest["ready"]:
+            latest["ready"].wait_for(lambda: latest["frame"] is not previous or stop_event.is_set(), timeout=1.0)
+            return latest["frame"] if latest["frame"] is not previous else None
+
+    def detect(job):
+        # Frames queued before the card was taken away still show it
+        DISPATCH.reset_if_moved(tracker, job["captured_at"])
+        job["card_approx"] = track_card(tracker, job["frame"])
+        if job["card_approx"] is None:
+            display.put(("Detected Card", job["frame"]))
+            return None
+        job["detected_at"] = time.perf_counter()
+        return job
+
+    def frames_after(frame):
+        previous = [frame]
+
+        def next_frame():
+            previous[0] = fresh_frame(previous[0])
+            return previous[0]
+        return next_frame
+
+    def read_name(job):
+        job["name"] = detect_card_name(job["frame"], job["card_approx"], frames_after(job["frame"]))
+        return job
+
+    def match(job):
+        job["chosen_id"], job["chosen_info"] = None, None
+        if job["name"] is not None:
+            job["chosen_id"], job["chosen_info"], _ = process_card_approx(job["frame"], job["card_approx"], current_sorting_mode, threshold, choice2, job["name"])
+        return job
+
+    def recognize_job(job):
+        job["name"], job["chosen_id"], job["chosen_info"], job["verified"] = recognize(
+            job["frame"], job["card_approx"], current_sorting_mode, threshold, choice2, frames_after(job["frame"]))
+        return job
+
+    def actuate(job):
+        display_frame = job["frame"].copy()
+        verified = job.get("verified", False)
+        card_bin = handle_card_result(display_frame, job["card_approx"], job["name"], job["chosen_id"], job["chosen_info"],
+                                      current_sorting_mode, threshold, choice2, verified)
+        record_card(results, job["origin"], job["detected_at"], job["name"], job["chosen_id"], job["chosen_info"],
+                    verified, card_bin)
+        DISPATCH.dispatched(cap, job["origin"])
+        display.put(("Detected Card", display_frame))
+
+    pipeline = Pipeline()
+    pipeline.add_stage("capture", capture, outbox=frames)
+    pipeline.add_stage("detect", detect, frames, detected)
+    if RECOGNITION_MODE == "ocr_first":
+        pipeline.add_stage("ocr", read_name, detected, named)
+        pipeline.add_stage("hash", match, named, matched)
+    else:
+        pipeline.add_stage("recognize", recognize_job, detected, matched)
+    pipeline.add_stage("actuator", actuate, matched)
+    pipeline.start()
+
+    last_report = time.time()
+    while any(stage.thread.is_alive() for stage in pipeline.stages):
+        try:
+            window, image = display.get(timeout=0.05)
+            show(window, image)
+        except queue.Empty:
+            pass
+        if quit_requested():
+            stop_event.set()
+        if time.time() - last_report >= PIPELINE_STATS_INTERVAL:
+            logger.info(pipeline.stats_report())
+            last_report = time.time()
+    logger.info(pipeline.stats_report())
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Recognize and sort cards from a camera or a recording")
+    parser.add_argument("--source", default="0", help="Camera index, video file or directory of card images")
+    parser.add_argument("--headless", action="store_true", help="Open no windows (replays, profiling)")
+    parser.add_argument("--realtime", action="store_true", help="Replay recordings at their recorded timing")
+    parser.add_argument("--fed", action="store_true", help="Replay an image directory back to back, each image until its card is dispatched")
+    parser.add_argument("--results", help="Write per-card results and timings to this JSON lines file")
+    parser.add_argument("--mode", help="Sorting mode (number or name); skips the interactive prompts")
+    parser.add_argument("--threshold", type=float, default=1000000, help="Price threshold for the buy mode")
+    parser.add_argument("--track-inventory", action="store_true", help="Reject cards already in the collection and add new ones (with --mode)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    global HEADLESS
+    args = parse_args(argv)
+    HEADLESS = args.headless
+    detectname.SHOW_ROI = detectname.SHOW_ROI and not HEADLESS
+    # Initialize serial, sorting options, etc.
+    # init_serial()
+    # Load OCR, card data, the name index and the hash index in the background while the user picks a mode
+    startup.warm_up(OCR_READER, CARD_STORE, HASH_SEARCH, NAME_INDEX)
+    if args.mode:
+        current_sorting_mode = SORTING_MODES.get(args.mode, args.mode)
+        if current_sorting_mode not in SORTING_MODES.values():
+            logger.error(f"Unknown sorting mode {args.mode}.")
+            sys.exit(1)
+        choice2 = "Y" if args.track_inventory else "N"
+        threshold = args.threshold
+    else:
+        print_sorting_options()
+        choice = input("Enter the number of the sorting method: ").strip()
+        choice2 = input("Track inventory? (Y/N): ").strip().upper() if choice in ["3", "6"] else "N"
+        current_sorting_mode = SORTING_MODES.get(choice, "color")
+        threshold = input("Enter a price threshold: ").strip() if current_sorting_mode == "buy" else 1000000
+    if choice2 == "Y":
+        INVENTORY.warm_up()
+    startup.mark("mode prompt")
+
+    cap = open_source(args.source, args.realtime, args.fed)
+    if not cap.isOpened():
+        logger.error(f"Cannot open frame source {args.source}.")
+        sys.exit(1)
+    startup.mark("camera open")
+    for resource in (OCR_READER, CARD_STORE, HASH_SEARCH, NAME_INDEX, INVENTORY):
+        resource.wait()
+    logger.info(startup.startup_report())
+
+    if METRICS_INTERVAL > 0:
+        METRICS.start_exporter(METRICS_PATH, METRICS_FORMAT, METRICS_INTERVAL)
+    results = CardResults(args.results)
+    if PIPELINE_ENABLED:
+        run_pipeline(cap, current_sorting_mode, threshold, choice2, results)
+    else:
+        run_sequential(cap, current_sorting_mode, threshold, choice2, results)
+    logger.info(results.summary())
+    results.close()
+    METRICS.stop_exporter()
+    if INVENTORY.loaded:
+        INVENTORY.get().close()
+
     cap.release()
-    cv2.destroyAllWindows()
+    if not HEADLESS:
+        cv2.destroyAllWindows()
+    if link is not None:
+        link.drain(SERIAL_READY_TIMEOUT)
+        link.close()
 
 if __name__ == "__main__":
     main()
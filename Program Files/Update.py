@@ -1,17 +1,28 @@
-import json
 import os
+import json
+import re
 import requests
 import glob
 import time
 import threading
 import queue
+import multiprocessing
 import imagehash
 from datetime import datetime, timedelta
 from PIL import Image, ImageFile
 from tqdm import tqdm
+from bulkdata import iter_bulk_cards
+from hashstore import HashDeltaLog, apply_delta, compact_hash_db, read_base_hashes
 
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
+HASH_WORKERS = os.cpu_count() or 1  # Hashing processes; PNG decoding and pHash are CPU-bound, so threads would share one core
+HASH_CHUNK_SIZE = 32  # Images per work unit sent to a hashing process
+HASH_LOG_BATCH = 256  # New hashes appended to the delta log (and fsynced) at a time
+COMPACT_MIN_ENTRIES = 5000  # Merge the delta log into card_hashes.json once it holds this many entries ...
+COMPACT_RATIO = 0.1  # ... and this fraction of the hashes in the JSON
+MAX_EVICTION_FRACTION = 0.1  # More printings than this missing from a snapshot looks like a bad download; nothing is evicted
+
 def organize_images_into_subfolders(image_dir):
     """Organize images into subfolders based on first character of filename (0-9,a-f)"""
     print("Organizing images into subfolders...")
@@ -86,38 +97,96 @@ def download_worker(session, download_queue, image_dir, download_results, progre
         progress_bar.update(1)
         download_queue.task_done()
 
-def hash_worker(hash_queue, image_dir, hashes_file, results, progress_bar):
-    while True:
-        card_id = hash_queue.get()
-        if card_id is None:
-            print("Hash worker received shutdown signal.")
-            hash_queue.task_done()
-            break
-        try:
-            first_char = card_id[0].lower()
-            png_path = os.path.join(image_dir, first_char, f"{card_id}.png")
-            if os.path.exists(png_path) and os.path.getsize(png_path) > 1024:
-                with Image.open(png_path) as img:
-                    if img.mode != 'RGB':
-                        img = img.convert('RGB')
-                    r, g, b = img.split()
-                    hashes = {
-                        'r_phash': get_original_style_hash(r),
-                        'g_phash': get_original_style_hash(g),
-                        'b_phash': get_original_style_hash(b)
-                    }
-                    if all(len(h) == 64 and all(c in '0123456789abcdef' for c in h) for h in hashes.values()):
-                        results[card_id] = hashes
-                    else:
-                        print(f"Hash format mismatch for {card_id}")
-                        results[card_id] = None
-            else:
-                results[card_id] = None
-        except Exception as e:
-            print(f"Error hashing {card_id}: {str(e)}")
-            results[card_id] = None
-        progress_bar.update(1)
-        hash_queue.task_done()
+def hash_card(card_id, image_dir):
+    """r/g/b pHashes of a downloaded card image, or None when it is missing or unreadable"""
+    first_char = card_id[0].lower()
+    png_path = os.path.join(image_dir, first_char, f"{card_id}.png")
+    if not (os.path.exists(png_path) and os.path.getsize(png_path) > 1024):
+        return None
+    try:
+        with Image.open(png_path) as img:
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            r, g, b = img.split()
+            hashes = {
+                'r_phash': get_original_style_hash(r),
+                'g_phash': get_original_style_hash(g),
+                'b_phash': get_original_style_hash(b)
+            }
+    except Exception as e:
+        print(f"Error hashing {card_id}: {str(e)}")
+        return None
+    if not all(len(h) == 64 and all(c in '0123456789abcdef' for c in h) for h in hashes.values()):
+        print(f"Hash format mismatch for {card_id}")
+        return None
+    return hashes
+
+def hash_chunk(args):
+    """Work unit of a hashing process: [(card_id, hashes or None)] for a chunk of card ids"""
+    card_ids, image_dir = args
+    return [(card_id, hash_card(card_id, image_dir)) for card_id in card_ids]
+
+def hash_images(card_ids, image_dir, workers=HASH_WORKERS, chunk_size=HASH_CHUNK_SIZE):
+    """Hash card images in a pool of processes, yielding (card_id, hashes or None) chunk by chunk as they finish"""
+    card_ids = list(card_ids)
+    chunks = [(card_ids[i:i + chunk_size], image_dir) for i in range(0, len(card_ids), chunk_size)]
+    if workers <= 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            yield from hash_chunk(chunk)
+        return
+    with multiprocessing.Pool(min(workers, len(chunks))) as pool:
+        for results in pool.imap_unordered(hash_chunk, chunks):
+            yield from results
+
+def card_image_path(image_dir, card_id):
+    return os.path.join(image_dir, card_id[0].lower(), f"{card_id}.png")
+
+def load_manifest(manifest_path):
+    """Image URL, image_status and last-seen bulk date of every printing the previous update synced"""
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_manifest(manifest_path, manifest):
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, separators=(',', ':'))
+    os.replace(tmp_path, manifest_path)
+
+def snapshot_date(json_file):
+    """Date of a bulk file, from its default-YYYYMMDD.json name or else its modification time"""
+    match = re.search(r"(\d{8})", os.path.basename(json_file))
+    if match:
+        return match.group(1)
+    return datetime.fromtimestamp(os.path.getmtime(json_file)).strftime('%Y%m%d')
+
+def manifest_entry(card, seen):
+    return {"png": card.get('image_uris', {}).get('png'), "image_status": card.get('image_status'), "seen": seen}
+
+def compute_delta(manifest, bulk_entries, existing_images, existing_hashes):
+    """New, changed and removed printings of the bulk snapshot relative to the manifest.
+
+    Printings the manifest does not know yet but that already have an image or
+    a hash (the first update with a manifest) are adopted as unchanged.
+    Printings whose image and hash have both gone missing are downloaded again,
+    printings without a png are skipped.
+    """
+    new, changed = set(), set()
+    for card_id, entry in bulk_entries.items():
+        if not entry["png"]:
+            continue
+        previous = manifest.get(card_id)
+        have = card_id in existing_images or card_id in existing_hashes
+        if previous is None:
+            if not have:
+                new.add(card_id)
+        elif entry["png"] != previous.get("png") or entry["image_status"] != previous.get("image_status"):
+            changed.add(card_id)
+        elif not have:
+            new.add(card_id)
+    removed = set(manifest) - set(bulk_entries)
+    return new, changed, removed
 
 def download_bulk_data(script_dir):
     bulk_data_url = "https://api.scryfall.com/bulk-data"
@@ -176,6 +245,8 @@ def main():
     script_dir = os.path.dirname(os.path.abspath(__file__))
     image_dir = os.path.join(script_dir, "card_images_png")
     hashes_path = os.path.join(script_dir, "card_hashes.json")
+    delta_path = os.path.join(script_dir, "card_hashes.delta.jsonl")
+    manifest_path = os.path.join(script_dir, "card_manifest.json")
     # Ensure directories exist
     os.makedirs(script_dir, exist_ok=True)
     os.makedirs(image_dir, exist_ok=True)
@@ -185,22 +256,21 @@ def main():
         print("Bulk data download failed or was cancelled. Exiting.")
         return
 
-    # Load existing hashes
-    if not os.path.exists(hashes_path):
-        with open(hashes_path, 'w') as f:
-            json.dump({}, f)
+    # Load existing hashes: card_hashes.json plus the hashes appended since it was last compacted
     try:
-        with open(hashes_path, 'r') as f:
-            existing_hashes = json.load(f)
-        print(f"Loaded {len(existing_hashes)} existing hashes")
-        sample = next(iter(existing_hashes.values()))
-        print(f"Sample hash format: {sample['r_phash'][:16]}... (length: {len(sample['r_phash'])})")
+        existing_hashes = read_base_hashes(hashes_path)
+        base_count = len(existing_hashes)
+        delta_count = apply_delta(existing_hashes, delta_path)
+        print(f"Loaded {len(existing_hashes)} existing hashes ({delta_count} from the delta log)")
+        if existing_hashes:
+            sample = next(iter(existing_hashes.values()))
+            print(f"Sample hash format: {sample['r_phash'][:16]}... (length: {len(sample['r_phash'])})")
     except Exception as e:
         print(f"Error loading hashes file: {str(e)}")
         return
 
     # Find missing images
-    print("\n=== FINDING MISSING IMAGES ===")
+    print("\n=== COMPUTING DELTA ===")
     existing_images = set()
     for first_char in '0123456789abcdef':
         subfolder = os.path.join(image_dir, first_char)
@@ -210,25 +280,61 @@ def main():
                 if f.endswith('.png')
             )
 
-    cards_to_download = {}
+    try:
+        manifest = load_manifest(manifest_path)
+    except Exception as e:
+        print(f"Error loading manifest, comparing against the images and hashes on disk instead: {str(e)}")
+        manifest = {}
+    bulk_entries = {}
     for json_file in glob.glob(os.path.join(script_dir, "default*.json")):
-        with open(json_file, 'r', encoding='utf-8') as f:
-            for card in json.load(f):
-                if card is None:
-                    continue
-                card_id = card.get('id')
-                if (card_id and 
-                    card_id not in existing_images and 
-                    card_id not in existing_hashes and
-                    not card.get('digital', False)):
-                    cards_to_download[card_id] = card
+        seen = snapshot_date(json_file)
+        for card in iter_bulk_cards(json_file):
+            card_id = card.get('id')
+            if card_id and not card.get('digital', False):
+                bulk_entries[card_id] = manifest_entry(card, seen)
 
+    new_cards, changed_cards, removed_cards = compute_delta(manifest, bulk_entries, existing_images, existing_hashes)
+    print(f"Snapshot has {len(bulk_entries)} printings: {len(new_cards)} new, {len(changed_cards)} with changed images, "
+          f"{len(removed_cards)} removed since the last update")
+
+    # Evict printings that left the catalog from the hash DB and the image folders
+    if removed_cards and len(removed_cards) > MAX_EVICTION_FRACTION * len(manifest):
+        print(f"Not evicting {len(removed_cards)} of {len(manifest)} printings - check the bulk data download")
+        removed_cards = set()
+    if removed_cards:
+        delta_log = HashDeltaLog(delta_path)
+        delta_log.remove(sorted(card_id for card_id in removed_cards if card_id in existing_hashes))
+        delta_log.close()
+        for card_id in removed_cards:
+            delta_count += existing_hashes.pop(card_id, None) is not None
+            manifest.pop(card_id, None)
+            if card_id in existing_images:
+                os.remove(card_image_path(image_dir, card_id))
+                existing_images.discard(card_id)
+        print(f"Evicted {len(removed_cards)} printings")
+
+    # Changed artwork replaces the old image and hash. The old hash is dropped before downloading, so a run
+    # interrupted before the new image is hashed leaves the card unhashed (and hashed next time), never stale
+    stale_hashes = sorted(card_id for card_id in changed_cards if card_id in existing_hashes)
+    if stale_hashes:
+        delta_log = HashDeltaLog(delta_path)
+        delta_log.remove(stale_hashes)
+        delta_log.close()
+        for card_id in stale_hashes:
+            del existing_hashes[card_id]
+        delta_count += len(stale_hashes)
+    for card_id in changed_cards:
+        if card_id in existing_images:
+            os.remove(card_image_path(image_dir, card_id))
+            existing_images.discard(card_id)
+
+    cards_to_download = {card_id: bulk_entries[card_id] for card_id in new_cards | changed_cards}
     total_to_download = len(cards_to_download)
-    print(f"Found {total_to_download} images needing download (missing both image and hash)")
+    print(f"Found {total_to_download} images needing download")
 
+    download_results = {}
     if total_to_download > 0:
         print("\n=== DOWNLOADING IMAGES ===")
-        download_results = {}
         download_queue = queue.Queue()
         download_progress = tqdm(total=total_to_download, desc="Downloading", unit="card")
 
@@ -243,8 +349,8 @@ def main():
                 t.start()
                 download_threads.append(t)
 
-            for card_id, card in cards_to_download.items():
-                download_queue.put((card_id, card))
+            for card_id, entry in cards_to_download.items():
+                download_queue.put((card_id, {'image_uris': {'png': entry["png"]}}))
             print("All download tasks enqueued.")
 
             download_queue.join()
@@ -261,87 +367,76 @@ def main():
 
         organize_images_into_subfolders(image_dir)
     else:
-        print("No images need downloading - all files already exist or have hashes")
+        print("No images need downloading - the catalog has not changed")
         successful_downloads = 0
 
-    # Find images needing hashes
+    # Record what was synced; failed downloads keep their old entry so the next update retries them
+    for card_id, entry in bulk_entries.items():
+        if card_id not in cards_to_download or download_results.get(card_id) or not entry["png"]:
+            manifest[card_id] = entry
+    try:
+        save_manifest(manifest_path, manifest)
+    except Exception as e:
+        print(f"Error saving manifest: {str(e)}")
+
+    # Find images needing hashes: new downloads, redownloaded artwork and images left unhashed by an interrupted run
     print("\n=== FINDING IMAGES NEEDING HASHES ===")
-    all_image_files = set()
-    for first_char in '0123456789abcdef':
-        subfolder = os.path.join(image_dir, first_char)
-        if os.path.exists(subfolder):
-            all_image_files.update(
-                f.split('.')[0] for f in os.listdir(subfolder)
-                if f.endswith('.png')
-            )
-    cards_needing_hashes = [card_id for card_id in all_image_files if card_id not in existing_hashes]
+    downloaded = {card_id for card_id, success in download_results.items() if success}
+    existing_images |= downloaded
+    cards_needing_hashes = [card_id for card_id in existing_images if card_id not in existing_hashes]
     total_to_hash = len(cards_needing_hashes)
     print(f"Found {total_to_hash} images needing hashes")
 
     if total_to_hash > 0:
-        print("\n=== PROCESSING HASHES ===")
+        print(f"\n=== PROCESSING HASHES ({HASH_WORKERS} processes) ===")
         hash_results = {}
-        hash_queue = queue.Queue()
         hash_progress = tqdm(total=total_to_hash, desc="Hashing", unit="card")
-
-        hash_threads = []
-        for _ in range(8):
-            t = threading.Thread(
-                target=hash_worker,
-                args=(hash_queue, image_dir, hashes_path, hash_results, hash_progress)
-            )
-            t.start()
-            hash_threads.append(t)
-
-        for card_id in cards_needing_hashes:
-            hash_queue.put(card_id)
-        print("Hashing tasks enqueued.")
-
-        hash_queue.join()
-        print("Hash queue completed.")
-        # Signal threads to finish
-        for _ in range(8):
-            hash_queue.put(None)
-
-        for t in hash_threads:
-            t.join()
-        print("Hash worker threads joined.")
-
-        # Save new hashes
+        # New hashes are appended to the delta log in batches, so an interrupted run resumes where it stopped
+        delta_log = HashDeltaLog(delta_path)
+        batch = {}
         try:
-            with open(hashes_path, 'r') as f:
-                current_hashes = json.load(f)
-            for card_id, hashes in hash_results.items():
+            for card_id, hashes in hash_images(cards_needing_hashes, image_dir):
+                hash_results[card_id] = hashes
                 if hashes:
-                    current_hashes[card_id] = hashes
-            with open(hashes_path, 'w') as f:
-                json.dump(current_hashes, f, indent=2)
-            print(f"\nAdded {len(hash_results)} new hashes.")
-        except Exception as e:
-            print(f"Error updating hashes file: {str(e)}")
+                    batch[card_id] = hashes
+                    if len(batch) >= HASH_LOG_BATCH:
+                        delta_log.append(batch)
+                        batch = {}
+                hash_progress.update(1)
+        finally:
+            delta_log.append(batch)
+            delta_log.close()
+            hash_progress.close()
+        print("Hashing completed.")
+        new_hashes = {card_id: hashes for card_id, hashes in hash_results.items() if hashes}
+        existing_hashes.update(new_hashes)
+        delta_count += len(new_hashes)
+        print(f"\nAdded {len(new_hashes)} new hashes to {os.path.basename(delta_path)}.")
     else:
         print("No images need hashing - all hashes already exist")
-        updated_hashes = 0
+        new_hashes = {}
+
+    # Merge the delta log into card_hashes.json once it is a sizeable part of it
+    if delta_count >= COMPACT_MIN_ENTRIES and delta_count >= COMPACT_RATIO * base_count:
+        try:
+            print(f"Compacting {delta_count} delta entries into {os.path.basename(hashes_path)}...")
+            compact_hash_db(hashes_path, delta_path)
+        except Exception as e:
+            print(f"Error compacting hashes file (the delta log is kept): {str(e)}")
 
     # Final verification
-    try:
-        with open(hashes_path, 'r') as f:
-            final_hashes = json.load(f)
-        print(f"\nFinal verification:")
-        print(f"Total hashes in file: {len(final_hashes)}")
-        new_hashes = {k: v for k, v in final_hashes.items() if k in cards_needing_hashes}
-        if new_hashes:
-            sample_id, sample_hash = next(iter(new_hashes.items()))
-            print(f"Sample new hash for {sample_id}:")
-            print(f"r_phash: {sample_hash['r_phash']}")
-            print(f"(Length: {len(sample_hash['r_phash'])})")
-    except Exception as e:
-        print(f"Error during final verification: {str(e)}")
+    print(f"\nFinal verification:")
+    print(f"Total hashes: {len(existing_hashes)}")
+    if new_hashes:
+        sample_id, sample_hash = next(iter(new_hashes.items()))
+        print(f"Sample new hash for {sample_id}:")
+        print(f"r_phash: {sample_hash['r_phash']}")
+        print(f"(Length: {len(sample_hash['r_phash'])})")
 
     elapsed_time = time.time() - start_time
     print(f"\n=== RESULTS ===")
     print(f"Total images downloaded: {successful_downloads}")
-    print(f"Total hashes added: {len(hash_results) if 'hash_results' in locals() else 0}")
+    print(f"Total hashes added: {len(new_hashes)}")
     print(f"Total time: {elapsed_time:.2f} seconds")
 
 if __name__ == "__main__":
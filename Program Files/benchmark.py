@@ -0,0 +1,222 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import cv2
+import numpy as np
+from PIL import Image
+
+import cards
+import hashing
+from cardstore import CardStore, build_card_store
+from config import CROP_SIZE
+from detection import find_card_contour, find_card_contour_pyramid, get_perspective_corrected_card, search_roi_around
+from detectname import denoised_variant, fast_variants, title_hash, title_roi
+from hashindex import HashIndex, MultiIndexHash
+from sorting import get_bin_number
+
+DEFAULT_BASELINE = "benchmark_baseline.json"
+DEFAULT_SIZES = (1000, 10000, 100000)
+GROUPS = ("detection", "hashing", "title", "card_info")
+
+def measure(func, min_time=0.05, rounds=5):
+    """Per-call times in ms over several rounds, each long enough (min_time) to time reliably"""
+    func()
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number *= 2 if elapsed * 2 >= min_time else 10
+    times = [elapsed / number]
+    for _ in range(rounds - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - start) / number)
+    return {
+        "median_ms": statistics.median(times) * 1000,
+        "min_ms": min(times) * 1000,
+        "mean_ms": statistics.mean(times) * 1000,
+        "calls": number * rounds,
+    }
+
+def synthetic_frame(seed=0):
+    """A 1080p frame with a light, slightly rotated card on a noisy dark table"""
+    rng = np.random.default_rng(seed)
+    frame = rng.integers(0, 60, (1080, 1920, 3)).astype(np.uint8)
+    corners = np.array([[500, 200], [1100, 230], [1080, 1050], [480, 1020]], np.int32)
+    cv2.fillPoly(frame, [corners], (230, 230, 230))
+    art = cv2.resize(rng.integers(0, 255, (12, 16, 3), dtype=np.uint8), (480, 360), interpolation=cv2.INTER_CUBIC)
+    frame[320:680, 560:1040] = art
+    cv2.putText(frame, "Grizzly Bears", (540, 290), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (20, 20, 20), 3)
+    return frame
+
+def synthetic_index(size, seed=0):
+    rng = np.random.default_rng(seed)
+    words = rng.integers(0, 2 ** 63, (3, size, 4), dtype=np.uint64)
+    return HashIndex([f"{i:08d}-0000-0000-0000-000000000000" for i in range(size)], words)
+
+def synthetic_cards(count, seed=0):
+    rng = np.random.default_rng(seed)
+    type_lines = ["Creature — Bear", "Instant", "Sorcery", "Artifact", "Enchantment", "Basic Land — Forest"]
+    for i in range(count):
+        yield {
+            "id": f"{i:08d}-0000-0000-0000-000000000000", "name": f"Card {i}", "set": f"s{i % 300:02d}",
+            "colors": list(rng.choice(list("WUBRG"), rng.integers(0, 3), replace=False)), "color_identity": [],
+            "cmc": float(rng.integers(0, 9)), "prices": {"usd": f"{rng.random() * 20:.2f}"}, "mana_cost": "{1}{G}",
+            "type_line": type_lines[i % len(type_lines)], "games": ["paper"], "lang": "en", "digital": False,
+        }
+
+def bench_detection(results, frame, contour):
+    results["find_card_contour"] = measure(lambda: find_card_contour(frame))
+    results["find_card_contour_pyramid"] = measure(lambda: find_card_contour_pyramid(frame))
+    roi = search_roi_around(contour, frame.shape)
+    results["find_card_contour_pyramid[roi]"] = measure(lambda: find_card_contour_pyramid(frame, roi))
+    results["get_perspective_corrected_card"] = measure(lambda: get_perspective_corrected_card(frame, contour))
+
+def bench_hashing(results, frame, contour, sizes):
+    warped = get_perspective_corrected_card(frame, contour)
+    img = Image.fromarray(cv2.cvtColor(warped[:CROP_SIZE, :CROP_SIZE], cv2.COLOR_BGR2RGB))
+    rotated = img.rotate(180)
+    results["hash_query"] = measure(lambda: hashing.hash_query(img))
+    for size in sizes:
+        hashing.ACTIVE_INDEX.set(synthetic_index(size))
+        hashing.HASH_SEARCH.set(None)
+        results[f"hash_image_color[{size}]"] = measure(lambda: hashing.hash_image_color(img))
+        results[f"compute_distances_for_image[{size}]"] = measure(lambda: hashing.compute_distances_for_image(img))
+        results[f"recognize_card[{size}]"] = measure(lambda: hashing.recognize_card({"upright": img, "rotated": rotated}))
+        # The scan of every row against the compact copies of the eligible rows that restricted() builds
+        index = hashing.ACTIVE_INDEX.get()
+        queries = np.stack([hashing.hash_query(img), hashing.hash_query(rotated)])
+        results[f"top_k_many[{size}]"] = measure(lambda: index.top_k_many(queries, 5, 100))
+        rng = np.random.default_rng(size)
+        for fraction in (0.95, 0.6):
+            mask = rng.random(size) < fraction
+            eligible = index.restricted(mask)
+            results[f"restricted[{fraction:.0%},{size}]"] = measure(lambda: index.restricted(mask))
+            results[f"top_k_many[{fraction:.0%} eligible,{size}]"] = measure(lambda: eligible.top_k_many(queries, 5, 100))
+        # The multi-index hash for a card that is not in the index, then for one that is
+        hashing.HASH_SEARCH.set(MultiIndexHash(hashing.ACTIVE_INDEX.get()))
+        results[f"recognize_card[mih,miss,{size}]"] = measure(lambda: hashing.recognize_card({"upright": img, "rotated": rotated}))
+        index = synthetic_index(size)
+        index.words[:, 0] = hashing.hash_query(img)
+        hashing.ACTIVE_INDEX.set(index)
+        hashing.HASH_SEARCH.set(MultiIndexHash(index))
+        results[f"recognize_card[mih,{size}]"] = measure(lambda: hashing.recognize_card({"upright": img, "rotated": rotated}))
+
+def bench_title(results, frame, contour):
+    roi = title_roi(frame, contour)
+    gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
+    results["title_roi"] = measure(lambda: title_roi(frame, contour))
+    results["title_fast_variants"] = measure(lambda: fast_variants(cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)))
+    results["title_denoised_variant"] = measure(lambda: denoised_variant(gray))
+    results["title_hash"] = measure(lambda: title_hash(roi))
+
+def bench_card_info(results, card_count):
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, "default-cards.json")
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(list(synthetic_cards(card_count)), f)
+        db_path = os.path.join(tmp, "cards.sqlite")
+        build_card_store(json_path, db_path)
+        store = CardStore(db_path)
+        cards.CARD_STORE.set(store)
+        rng = np.random.default_rng(0)
+        # Mostly distinct ids, like a stream of different cards, so the store's LRU rarely hits
+        ids = itertools.cycle([f"{i:08d}-0000-0000-0000-000000000000" for i in rng.integers(0, card_count, 100000)])
+        results["extract_card_info"] = measure(lambda: cards.extract_card_info(next(ids)))
+        info = cards.extract_card_info(next(ids))
+        store.conn.close()
+    for mode in ("color", "mana_value", "set", "price", "type", "buy"):
+        results[f"get_bin_number[{mode}]"] = measure(lambda: get_bin_number(info, mode, 5.0))
+
+def run(sizes=DEFAULT_SIZES, card_count=20000, only=None):
+    results = {}
+    selected = set(GROUPS if only is None else only)
+    frame = synthetic_frame()
+    contour = find_card_contour(frame)
+    if "detection" in selected:
+        bench_detection(results, frame, contour)
+    if "hashing" in selected:
+        bench_hashing(results, frame, contour, sizes)
+    if "title" in selected:
+        bench_title(results, frame, contour)
+    if "card_info" in selected:
+        bench_card_info(results, card_count)
+    return {
+        "meta": {
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor() or platform.machine(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "sizes": list(sizes),
+        },
+        "results": results,
+    }
+
+def compare(current, baseline, tolerance):
+    """Lines comparing median times with the baseline, and the names that got slower than tolerance allows"""
+    lines, regressions = [], []
+    for name, result in current["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            lines.append(f"  {name:<40} {result['median_ms']:10.3f} ms   (new)")
+            continue
+        ratio = result["median_ms"] / before["median_ms"] if before["median_ms"] else float('inf')
+        flag = ""
+        if ratio > 1 + tolerance:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        elif ratio < 1 - tolerance:
+            flag = "  faster"
+        lines.append(f"  {name:<40} {result['median_ms']:10.3f} ms  baseline {before['median_ms']:10.3f} ms  x{ratio:5.2f}{flag}")
+    return lines, regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of the recognition hot paths")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown before a regression (0.25 = 25%%)")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="Hash DB sizes to benchmark")
+    parser.add_argument("--cards", type=int, default=20000, help="Cards in the synthetic card store")
+    parser.add_argument("--only", help="Comma-separated groups: detection, hashing, title, card_info")
+    args = parser.parse_args()
+
+    current = run([int(size) for size in args.sizes.split(",")], args.cards,
+                  set(args.only.split(",")) if args.only else None)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(current, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(current, f, indent=2)
+        print(f"Saved baseline to {args.baseline}.")
+
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        lines, regressions = compare(current, baseline, args.tolerance)
+        print(f"Benchmark results vs {args.baseline} ({baseline['meta'].get('date')}):")
+        print("\n".join(lines))
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+    else:
+        print("Benchmark results:")
+        for name, result in current["results"].items():
+            print(f"  {name:<40} {result['median_ms']:10.3f} ms  (min {result['min_ms']:.3f}, {result['calls']} calls)")
+
+if __name__ == "__main__":
+    main()
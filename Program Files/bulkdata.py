@@ -0,0 +1,43 @@
+import json
+
+def iter_bulk_cards(path, chunk_size=1 << 20):
+    """Yield the cards of a Scryfall bulk file (one JSON array) one at a time.
+
+    Only a chunk of text and the card being decoded are held in memory, so the
+    full catalog can be scanned on a small box without swapping.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer = f.read(chunk_size)
+        pos = 0
+        eof = not buffer
+        in_array = False
+        while True:
+            # Skip whitespace and separators, topping the buffer up when it runs dry
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos == len(buffer):
+                if eof:
+                    raise ValueError(f"{path} ended before the closing ']'")
+                buffer, pos = f.read(chunk_size), 0
+                eof = not buffer
+                continue
+            if not in_array:
+                if buffer[pos] != '[':
+                    raise ValueError(f"{path} is not a JSON array")
+                in_array = True
+                pos += 1
+                continue
+            if buffer[pos] == ']':
+                return
+            try:
+                card, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                more = f.read(chunk_size)
+                if not more:
+                    raise
+                buffer, pos = buffer[pos:] + more, 0
+                continue
+            pos = end
+            if card is not None:
+                yield card
@@ -1,84 +1,127 @@
 import os
 import json
 import glob
+import hashlib
+import numpy as np
 
-from config import EXCLUDED_SETS
-
-CARDS_DATA = []
-CARD_DATA_BY_ID = {}
+from cardstore import CardStore, build_card_store
+from nameindex import NameIndex
+from startup import LazyResource
+from config import EXCLUDED_SETS, ALLOWED_LANGUAGES, ELIGIBILITY_MASK_PATH, CARD_STORE_PATH
 
 # Construct the wildcard pattern in the current directory
 default_files_pattern = 'default*.json'
 
-# Find all files matching the pattern in the current directory
-default_files = glob.glob(default_files_pattern)
-
-# Sort files by modification time (newest first)
-default_files.sort(key=os.path.getmtime, reverse=True)
-
-# Check if any files were found
-if default_files:
-    # Get the path of the newest file
-    newest_file_path = default_files[0]
+def newest_default_file():
+    # Sort files by modification time (newest first)
+    default_files = sorted(glob.glob(default_files_pattern), key=os.path.getmtime, reverse=True)
+    return default_files[0] if default_files else None
 
-    if os.path.exists(newest_file_path):
+def load_card_store():
+    """Open the slim card store, rebuilding it when the newest default*.json is newer"""
+    newest_file_path = newest_default_file()
+    if newest_file_path is None and not os.path.exists(CARD_STORE_PATH):
+        print(f"No files matching the pattern '{default_files_pattern}' found.")
+        return None
+    if newest_file_path and (not os.path.exists(CARD_STORE_PATH) or
+                             os.path.getmtime(newest_file_path) > os.path.getmtime(CARD_STORE_PATH)):
         try:
-            with open(newest_file_path, 'r', encoding='utf-8') as f:
-                file_data = json.load(f)
-                CARDS_DATA.extend(file_data)
-        except json.JSONDecodeError as e:
+            build_card_store(newest_file_path, CARD_STORE_PATH)
+        except ValueError as e:
             print(f"Error decoding JSON from {newest_file_path}: {e}")
         except Exception as e:
             print(f"An error occurred while reading {newest_file_path}: {e}")
-    else:
-        print(f"Error: The newest file path '{newest_file_path}' does not exist.")
-else:
-    print(f"No files matching the pattern '{default_files_pattern}' found.")
+    if not os.path.exists(CARD_STORE_PATH):
+        return None
+    store = CardStore(CARD_STORE_PATH)
+    print(f"Opened card store {CARD_STORE_PATH} with {len(store)} card entries.")
+    return store
 
+CARD_STORE = LazyResource("card store", load_card_store)
 
-CARD_DATA_BY_ID = {c['id']: c for c in CARDS_DATA}
-total_entries_loaded = len(CARDS_DATA)
-print(f"Successfully loaded {total_entries_loaded} card entries from the newest default*.json file ({newest_file_path}).")
+def load_name_index():
+    store = get_card_store()
+    index = NameIndex(store.id_names() if store else [])
+    print(f"Indexed {len(index)} card names.")
+    return index
+
+NAME_INDEX = LazyResource("name index", load_name_index)
+
+def get_card_store():
+    return CARD_STORE.get()
+
+def get_card(card_id):
+    store = get_card_store()
+    return store.get(card_id) if store else None
 
 def extract_card_info(card_id):
-    card = CARD_DATA_BY_ID.get(card_id)
+    card = get_card(card_id)
     if not card:
         return None
-    name = card.get('name', 'Unknown')
-    set_code = card.get('set', '???')
-    colors = card.get('colors', [])
-    color_identity = card.get('color_identity', [])
-    cmc = card.get('cmc')
-    is_promo = card.get('Promo')
-    usd_price = card.get('prices', {}).get('usd')
+    usd_price = card['usd']
     price_str = "null"
-    mana_cost = card.get('mana_cost', '???')
     if usd_price:
         try:
             price_str = f"${float(usd_price):.2f}"  # Simplified price formatting
         except (ValueError, TypeError):  # Handle potential errors
             pass
-    types = [t for t in ["creature", "artifact", "enchantment", "instant", "sorcery", "battle", "planeswalker", "land", "token"]
-             if t in card.get('type_line', '').lower()] # Simplified type extraction
     return {
-        "Name": name,"Set": set_code,"Colors": colors,"Color Identity": color_identity,"CMC": cmc,"Types": types,"Price": price_str,"Promo": is_promo,"Mana Cost": mana_cost
+        "Name": card['name'],"Set": card['set'],"Colors": card['colors'],"Color Identity": card['color_identity'],"CMC": card['cmc'],"Types": card['types'],"Price": price_str,"Promo": card['promo'],"Mana Cost": card['mana_cost']
     }
 
-def card_is_allowed(card_id):
-    card = CARD_DATA_BY_ID.get(card_id)
-    if not card:
+def card_is_eligible(card):
+    if not card or card['digital'] or not card['paper']:
+        return False
+    if ALLOWED_LANGUAGES is not None and card['lang'] not in ALLOWED_LANGUAGES:
         return False
-    set_code = card.get('set', '').lower()
-    games = card.get('games', [])
-    return 'paper' in games and set_code not in EXCLUDED_SETS  # Combined conditions
+    return card['set'].lower() not in EXCLUDED_SETS
+
+def card_is_allowed(card_id):
+    return card_is_eligible(get_card(card_id))
+
+def eligibility_signature(card_ids):
+    """Everything the eligibility mask depends on: the filters, the card data and the row order"""
+    h = hashlib.sha1()
+    h.update(json.dumps([sorted(EXCLUDED_SETS), sorted(ALLOWED_LANGUAGES or []), ALLOWED_LANGUAGES is None]).encode())
+    store = get_card_store()
+    h.update((store.signature() if store else "no card data").encode())
+    h.update("\n".join(card_ids).encode())
+    return h.hexdigest()
+
+def build_eligibility_mask(card_ids, cache_path=ELIGIBILITY_MASK_PATH):
+    """Boolean mask aligned with card_ids (hash index rows), cached until the filters or card data change"""
+    card_ids = list(card_ids)
+    signature = eligibility_signature(card_ids)
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with np.load(cache_path) as cached:
+                if str(cached['signature']) == signature:
+                    return cached['mask']
+        except (OSError, KeyError, ValueError) as e:
+            print(f"Ignoring unreadable eligibility cache {cache_path}: {e}")
+    store = get_card_store()
+    eligible = store.eligible_ids(EXCLUDED_SETS, ALLOWED_LANGUAGES) if store else set()
+    mask = np.fromiter((card_id in eligible for card_id in card_ids), dtype=bool, count=len(card_ids))
+    if cache_path:
+        np.savez(cache_path, mask=mask, signature=np.array(signature))
+    print(f"Built eligibility mask: {int(mask.sum())} of {len(mask)} hashed cards allowed.")
+    return mask
+
+def get_card_name(card_id):
+    card = get_card(card_id)
+    return card['name'] if card else None
 
 def get_illustration_id(card_id):
-    card = CARD_DATA_BY_ID.get(card_id)
-    return card.get('illustration_id') if card else None  # Simplified
+    card = get_card(card_id)
+    return card['illustration_id'] if card else None  # Simplified
 
 def get_same_illustration_english_candidates(illustration_id):
-    return [  # List comprehension with combined conditions
-        c['id'] for c in CARDS_DATA
-        if c.get('illustration_id') == illustration_id and c.get('lang') == 'en' and
-           'paper' in c.get('games', []) and c.get('set', '').lower() not in EXCLUDED_SETS
-    ]
+    store = get_card_store()
+    if not store:
+        return []
+    candidates = []
+    for cid in store.ids_with_illustration(illustration_id):
+        card = store.get(cid)
+        if card['lang'] == 'en' and card['paper'] and card['set'].lower() not in EXCLUDED_SETS:
+            candidates.append(cid)
+    return candidates
@@ -0,0 +1,134 @@
+import os
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from bulkdata import iter_bulk_cards
+
+# Type words extract_card_info reports, in order; stored as a bitmask per card
+CARD_TYPES = ["creature", "artifact", "enchantment", "instant", "sorcery", "battle", "planeswalker", "land", "token"]
+
+SCHEMA = """
+CREATE TABLE sets (set_id INTEGER PRIMARY KEY, code TEXT UNIQUE NOT NULL);
+CREATE TABLE cards (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    set_id INTEGER REFERENCES sets(set_id),
+    colors TEXT,
+    color_identity TEXT,
+    cmc REAL,
+    promo INTEGER,
+    usd TEXT,
+    mana_cost TEXT,
+    types INTEGER,
+    paper INTEGER,
+    digital INTEGER,
+    lang TEXT,
+    illustration_id TEXT
+) WITHOUT ROWID;
+CREATE INDEX cards_illustration ON cards(illustration_id);
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+def type_mask(type_line):
+    type_line = (type_line or '').lower()
+    return sum(1 << i for i, t in enumerate(CARD_TYPES) if t in type_line)
+
+def types_from_mask(mask):
+    return [t for i, t in enumerate(CARD_TYPES) if mask & (1 << i)]
+
+def build_card_store(json_path, db_path):
+    """Compile the fields the sorter reads from a Scryfall bulk file into a small SQLite store"""
+    start_time = time.time()
+    tmp_path = db_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.executescript(SCHEMA)
+        set_ids = {}
+        count = 0
+
+        def rows():
+            nonlocal count
+            for card in iter_bulk_cards(json_path):
+                if not card.get('id'):
+                    continue
+                set_code = card.get('set', '')
+                if set_code not in set_ids:
+                    set_ids[set_code] = len(set_ids) + 1
+                count += 1
+                yield (
+                    card['id'], card.get('name', 'Unknown'), set_ids[set_code],
+                    ''.join(card.get('colors', [])), ''.join(card.get('color_identity', [])),
+                    card.get('cmc'), int(bool(card.get('promo'))), card.get('prices', {}).get('usd'),
+                    card.get('mana_cost', '???'), type_mask(card.get('type_line')),
+                    int('paper' in card.get('games', [])), int(bool(card.get('digital', False))),
+                    card.get('lang'), card.get('illustration_id'),
+                )
+
+        # Cards are streamed straight from the bulk file into SQLite
+        conn.executemany("INSERT OR REPLACE INTO cards VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows())
+        conn.executemany("INSERT INTO sets (code, set_id) VALUES (?, ?)", set_ids.items())
+        conn.executemany("INSERT INTO meta VALUES (?, ?)", [
+            ("source", os.path.basename(json_path)),
+            ("source_mtime", repr(os.path.getmtime(json_path))),
+        ])
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, db_path)
+    print(f"Built card store {db_path} with {count} cards from {json_path} in {time.time() - start_time:.1f}s.")
+
+class CardStore:
+    """Read-only, thread-safe lookups of slim card records keyed by card id"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        self.get = lru_cache(maxsize=4096)(self._get)
+
+    def _query(self, sql, params=()):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def _get(self, card_id):
+        rows = self._query("SELECT cards.*, sets.code AS set_code FROM cards JOIN sets USING (set_id) WHERE id = ?", (card_id,))
+        if not rows:
+            return None
+        row = rows[0]
+        return {
+            'id': row['id'], 'name': row['name'], 'set': row['set_code'],
+            'colors': list(row['colors']), 'color_identity': list(row['color_identity']),
+            'cmc': row['cmc'], 'promo': bool(row['promo']), 'usd': row['usd'],
+            'mana_cost': row['mana_cost'], 'types': types_from_mask(row['types']),
+            'paper': bool(row['paper']), 'digital': bool(row['digital']),
+            'lang': row['lang'], 'illustration_id': row['illustration_id'],
+        }
+
+    def __len__(self):
+        return self._query("SELECT COUNT(*) FROM cards")[0][0]
+
+    def id_names(self):
+        """(id, name) of every card, for building the name index"""
+        return [tuple(row) for row in self._query("SELECT id, name FROM cards")]
+
+    def eligible_ids(self, excluded_sets, languages=None):
+        """Ids of paper, non-digital cards outside excluded_sets (and in languages, if given)"""
+        sql = ("SELECT id FROM cards JOIN sets USING (set_id) WHERE paper = 1 AND digital = 0 "
+               f"AND lower(code) NOT IN ({','.join('?' * len(excluded_sets))})")
+        params = [s.lower() for s in excluded_sets]
+        if languages is not None:
+            sql += f" AND lang IN ({','.join('?' * len(languages))})"
+            params += list(languages)
+        return {row[0] for row in self._query(sql, params)}
+
+    def ids_with_illustration(self, illustration_id):
+        rows = self._query("SELECT id FROM cards WHERE illustration_id = ?", (illustration_id,))
+        return [row[0] for row in rows]
+
+    def signature(self):
+        rows = dict(self._query("SELECT key, value FROM meta"))
+        return f"{rows.get('source')}:{rows.get('source_mtime')}"
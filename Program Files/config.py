@@ -5,15 +5,29 @@
 CROP_SIZE = 745          # Size of the image crop for hashing
 WIDTH = 745              # Width of the perspective-corrected card image
 HEIGHT = 1043            # Height of the perspective-corrected card image
-MAX_DISTANCE_THRESHOLD = 100  # Hashing match threshold
+CARD_MIN_AREA = 10000    # Smallest contour area (full-resolution pixels) accepted as a card
+DETECTION_MODE = "full"  # "full" runs contour detection on every full frame, "pyramid" on a downscaled copy (about 4x cheaper at 1080p, 8x within the tracked card's window)
+DETECTION_WIDTH = 640    # Frame width used by the "pyramid" detection mode
+DETECTION_ROI_MARGIN = 0.25  # Extra border, relative to the card size, searched around the last known card
+MAX_DISTANCE_THRESHOLD = 100  # Hashing match threshold (average r/g/b pHash distance, 0-256)
+RECOGNITION_TOP_K = 5  # Candidates kept per orientation when ranking hash matches
+HASH_SEARCH_MODE = "exhaustive"  # "exhaustive" scans every card, "mih" uses the multi-index hash for sublinear lookups
 
 # Data Paths (Consider making these relative to the script's location)
 HASH_DB_PATH = "card_hashes.json"  # If you are using one
+HASH_DELTA_PATH = "card_hashes.delta.jsonl"  # Hashes Update.py appended since it last compacted them into HASH_DB_PATH
+HASH_INDEX_PATH = "card_hashes.bin"  # Compiled, memory-mapped copy of HASH_DB_PATH and HASH_DELTA_PATH (rebuilt when either is newer)
+CARD_STORE_PATH = "cards.sqlite"  # Slim card metadata built from the newest default*.json
 IMAGES_DIR = "downloaded_cards"      # If you are using one
 LAYOUT_SIGNATURES_JSON = "layout_signatures.json" # If you are using one
 
 # Card Set Exclusion
 EXCLUDED_SETS = {"30a", "lea", "leb", "fbb", "ced", "cei", "4bb", "ptc", "sum"}
+ALLOWED_LANGUAGES = None  # e.g. {"en"} to only match English printings, None allows every language
+ELIGIBILITY_MASK_PATH = "eligibility_mask.npz"  # Cached per-row eligibility of the hash index
+INVENTORY_PATH = "Collection/Collection.txt"  # Append-only journal of the tracked collection, one card id per line
+INVENTORY_SYNC_EVERY = 50  # Journal lines written before they are fsynced to disk ...
+INVENTORY_SYNC_INTERVAL = 5  # ... or seconds since the last sync, whichever comes first
 
 # Sorting Options
 SORTING_MODES = {
@@ -30,10 +44,41 @@ SERIAL_PORT = "COM3"  # Your serial port
 BAUD_RATE = 9600
 START_MARKER = 60
 END_MARKER = 62
+SERIAL_QUEUE_SIZE = 2  # Sort commands queued while the machine is still moving the previous card
+SERIAL_READY_TIMEOUT = 30  # seconds without "Arduino is ready" before a warning is logged
+
+# Card tracking (recognize each physical card once)
+CARD_TRACKING_ENABLED = True
+CARD_STABLE_FRAMES = 3  # Frames the contour must hold still before recognition starts
+CARD_MISSING_FRAMES = 5  # Frames without a contour before the card counts as gone
+CARD_SIMILARITY_TOLERANCE = 0.05  # Allowed relative bounding-box area change between frames
+CARD_MAX_SHIFT = 20  # Allowed movement of the card centre between frames, in pixels
+
+# Recognition loop
+# "ocr_first" reads the name then matches the hash, "hash_first" skips OCR when the hash match is decisive,
+# "concurrent" runs both at once and cancels OCR when the hash match is decisive
+RECOGNITION_MODE = "hash_first"
+HASH_DECISIVE_DISTANCE = 50  # A hash match this close ...
+HASH_DECISIVE_MARGIN = 25  # ... and this far ahead of the closest card with another name is trusted without reading the name
+OCR_TASK_TIMEOUT = 15  # seconds to wait for name detection in concurrent mode
+HASH_TASK_TIMEOUT = 5  # seconds to wait for hash matching in concurrent mode
+PIPELINE_ENABLED = False  # Run capture, detection, OCR, hashing and the actuator as concurrent stages
+PIPELINE_QUEUE_SIZE = 2  # Items buffered between stages; stale frames and detections are dropped first
+PIPELINE_STATS_INTERVAL = 10  # seconds between per-stage throughput reports
+
+# Metrics (timers, counters and latency percentiles)
+METRICS_PATH = "metrics.prom"  # Exported metrics file
+METRICS_FORMAT = "text"  # "text" rewrites METRICS_PATH in Prometheus text format, "csv" appends rows to it
+METRICS_INTERVAL = 10  # seconds between exports (0 disables the exporter)
 
 # Name Detection
 MAX_ATTEMPTS_NAME = 5
 TIMEOUT_NAME = 10  # seconds
+OCR_CACHE_SIZE = 256  # Title strips remembered by the OCR cache (0 disables it)
+OCR_CACHE_TOLERANCE = 10  # Max differing bits (of 2048) for two title strips to share a cached name; the same title shifted by up to 3px differs by at most 8, names one letter apart (Grizzly Bears/Beard) by 18 or more
+NAME_INDEX_ENABLED = True  # Search only the printings of the OCR'd name, falling back to every card when the name is unknown
+NAME_MATCH_MIN_SCORE = 0.6  # Minimum trigram overlap (0-1) between the OCR reading and a card name
+NAME_MATCH_LIMIT = 3  # Most card names whose printings are searched for one OCR reading
 
 # Model
 MODEL_PATH = "mana_v14.pt"
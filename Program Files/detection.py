@@ -1,8 +1,10 @@
 import cv2
 import numpy as np
-from config import WIDTH, HEIGHT
+from config import WIDTH, HEIGHT, DETECTION_MODE, DETECTION_WIDTH, DETECTION_ROI_MARGIN, CARD_MIN_AREA, CARD_STABLE_FRAMES, CARD_MISSING_FRAMES, CARD_SIMILARITY_TOLERANCE, CARD_MAX_SHIFT
 
-def find_card_contour(frame):
+def find_card_contour(frame, search_roi=None):
+    if DETECTION_MODE == "pyramid":
+        return find_card_contour_pyramid(frame, search_roi)
     gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
     blurred = cv2.GaussianBlur(gray, (3, 3), 0)
     edges = cv2.Canny(blurred, 50, 150)
@@ -15,11 +17,72 @@ def find_card_contour(frame):
         approx = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True)
         if len(approx) == 4:
             area = cv2.contourArea(approx)
-            if area > 10000 and area > max_area:
+            if area > CARD_MIN_AREA and area > max_area:
                 max_area = area
                 best_contour = approx
     return best_contour
 
+def search_roi_around(contour, frame_shape, margin=DETECTION_ROI_MARGIN):
+    """(x, y, w, h) window around a known card position, grown by margin of its size on each side"""
+    x, y, w, h = cv2.boundingRect(contour)
+    dx, dy = int(w * margin), int(h * margin)
+    x0, y0 = max(0, x - dx), max(0, y - dy)
+    x1, y1 = min(frame_shape[1], x + w + dx), min(frame_shape[0], y + h + dy)
+    return x0, y0, x1 - x0, y1 - y0
+
+def refine_corners(frame, corners, window):
+    """Sub-pixel corner positions measured on small full-resolution patches"""
+    refined = []
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 0.1)
+    for cx, cy in corners:
+        x0, y0 = max(0, int(cx) - 2 * window), max(0, int(cy) - 2 * window)
+        patch = frame[y0:int(cy) + 2 * window + 1, x0:int(cx) + 2 * window + 1]
+        if min(patch.shape[:2]) <= 2 * window + 1:
+            refined.append((cx, cy))  # Too close to the frame edge to refine
+            continue
+        gray = cv2.cvtColor(patch, cv2.COLOR_BGR2GRAY)
+        point = np.array([[[cx - x0, cy - y0]]], dtype=np.float32)
+        cv2.cornerSubPix(gray, point, (window, window), (-1, -1), criteria)
+        refined.append((point[0, 0, 0] + x0, point[0, 0, 1] + y0))
+    return refined
+
+def find_card_contour_pyramid(frame, search_roi=None):
+    """find_card_contour on a downscaled copy (optionally of a region only), corners refined at full size"""
+    offset_x, offset_y = 0, 0
+    if search_roi is not None:
+        offset_x, offset_y, w, h = search_roi
+        frame_region = frame[offset_y:offset_y + h, offset_x:offset_x + w]
+    else:
+        frame_region = frame
+    scale = min(1.0, DETECTION_WIDTH / frame.shape[1])
+    # Bilinear, not area averaging: the blur below smooths enough for edges, and INTER_AREA
+    # alone cost more than the rest of the detection at 1080p
+    small = frame_region if scale == 1.0 else cv2.resize(frame_region, None, fx=scale, fy=scale, interpolation=cv2.INTER_LINEAR)
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    blurred = cv2.GaussianBlur(gray, (3, 3), 0)
+    edges = cv2.Canny(blurred, 50, 150)
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+    closed = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, kernel)
+    contours, _ = cv2.findContours(closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    min_area = CARD_MIN_AREA * scale * scale
+    best_contour = None
+    max_area = 0
+    for contour in contours:
+        # Cheap area test first; only plausible card-sized contours get polygon approximation
+        if cv2.contourArea(contour) <= min_area:
+            continue
+        approx = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True)
+        if len(approx) == 4:
+            area = cv2.contourArea(approx)
+            if area > min_area and area > max_area:
+                max_area = area
+                best_contour = approx
+    if best_contour is None:
+        return None
+    corners = [(x / scale + offset_x, y / scale + offset_y) for x, y in best_contour.reshape(4, 2)]
+    corners = refine_corners(frame, corners, max(2, int(round(1 / scale)) + 1))
+    return np.array(corners, dtype=np.float32).round().astype(np.int32).reshape(4, 1, 2)
+
 def get_perspective_corrected_card(frame, contour):
     pts = contour.reshape(4, 2)
     pts = sorted(pts, key=lambda point: point[1])
@@ -46,3 +109,55 @@ def contours_are_similar(contour1, contour2, tolerance=0.01):
     area2 = w2 * h2
     area_diff_ratio = abs(area1 - area2) / (area1 + 1)
     return area_diff_ratio < tolerance
+
+def contour_center(contour):
+    x, y, w, h = cv2.boundingRect(contour)
+    return x + w / 2, y + h / 2
+
+class CardTracker:
+    """Follows the card contour across frames so each physical card is recognized once.
+
+    update() returns the contour exactly once per card arrival: after it has been
+    seen in place for stable_frames frames. Nothing more is returned until the card
+    has been missing for missing_frames frames, or until reset() is called once
+    the machine has taken it away (Main.DispatchWatch), after which the next card
+    counts as a new arrival even if it lies exactly where the last one did.
+    """
+
+    def __init__(self, stable_frames=CARD_STABLE_FRAMES, missing_frames=CARD_MISSING_FRAMES,
+                 tolerance=CARD_SIMILARITY_TOLERANCE, max_shift=CARD_MAX_SHIFT):
+        self.stable_frames = stable_frames
+        self.missing_frames = missing_frames
+        self.tolerance = tolerance
+        self.max_shift = max_shift
+        self.reset()
+
+    def reset(self):
+        self.last = None
+        self.stable = 0
+        self.missing = 0
+        self.recognized = False
+
+    def same_card(self, contour1, contour2):
+        (x1, y1), (x2, y2) = contour_center(contour1), contour_center(contour2)
+        shift = ((x1 - x2) ** 2 + (y1 - y2) ** 2) ** 0.5
+        return shift <= self.max_shift and contours_are_similar(contour1, contour2, self.tolerance)
+
+    def update(self, contour):
+        if contour is None:
+            self.missing += 1
+            if self.last is not None and self.missing >= self.missing_frames:
+                self.reset()  # Card has left
+            return None
+        self.missing = 0
+        if self.last is not None and self.same_card(contour, self.last):
+            self.stable += 1
+        else:
+            # A new card, or the current one moved: wait for it to settle again
+            self.stable = 1
+            self.recognized = False
+        self.last = contour
+        if not self.recognized and self.stable >= self.stable_frames:
+            self.recognized = True
+            return contour
+        return None
@@ -1,11 +1,84 @@
 import cv2
 import numpy as np
-import easyocr
+import threading
+from collections import Counter, OrderedDict
 from difflib import SequenceMatcher
-
-# Initialize EasyOCR reader once
-# Specify the languages you expect, e.g., English
-reader = easyocr.Reader(['en'])
+from config import OCR_CACHE_SIZE, OCR_CACHE_TOLERANCE
+from startup import LazyResource
+
+def load_reader():
+    import easyocr  # Pulls in torch; deferred until OCR is first needed or warmed up
+    # Specify the languages you expect, e.g., English
+    return easyocr.Reader(['en'])
+
+# Initialize EasyOCR reader once, on first use
+OCR_READER = LazyResource("OCR reader", load_reader)
+
+# Show the cropped title strip in its own window (only safe from the main thread)
+SHOW_ROI = True
+
+def title_hash(roi, width=128, height=16):
+    """Ink mask of the title text at low resolution, as an int of width * height bits.
+
+    The strip is first cropped to the bounding box of its ink blobs that do not
+    touch its edges (the letters and mana symbols, not the card frame), so a
+    card that lies a few pixels off hashes alike. Thresholding rather than
+    comparing neighbours keeps flat background cells stable under sensor noise.
+    """
+    gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
+    _, ink = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    _, _, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    x, y, w, h, area = stats[1:].T
+    inner = (x > 0) & (y > 0) & (x + w < ink.shape[1]) & (y + h < ink.shape[0]) & (area >= 4)
+    if inner.any():
+        gray = gray[y[inner].min():(y + h)[inner].max(), x[inner].min():(x + w)[inner].max()]
+    gray = cv2.normalize(gray, None, 0, 255, cv2.NORM_MINMAX)
+    small = cv2.resize(gray, (width, height), interpolation=cv2.INTER_AREA)
+    bits = (small < 128).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+class TitleCache:
+    """LRU of OCR results keyed by title_hash, matching keys exactly or (tolerance > 0) within a Hamming distance"""
+
+    def __init__(self, size=OCR_CACHE_SIZE, tolerance=OCR_CACHE_TOLERANCE):
+        self.size = size
+        self.tolerance = tolerance
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            match = key if key in self.entries else None
+            if match is None and self.tolerance > 0:
+                best = self.tolerance + 1
+                for cached_key in self.entries:
+                    distance = bin(cached_key ^ key).count("1")
+                    if distance < best:
+                        match, best = cached_key, distance
+            if match is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(match)
+            return self.entries[match]
+
+    def put(self, key, name):
+        if self.size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = name
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.0
+        return f"OCR cache: {self.hits} hits, {self.misses} misses ({hit_rate:.0%}), {len(self.entries)} entries"
+
+OCR_CACHE = TitleCache()
 
 def is_reasonable_text(text):
     """Check if text looks like a plausible word/name without being too strict"""
@@ -26,68 +99,97 @@ def is_reasonable_text(text):
     
     return True
 
+def title_roi(frame, card_contour):
+    x_card, y_card, w_card, h_card = cv2.boundingRect(card_contour)
+    
+    # Expanded ROI to capture more of the text area
+    roi_top_start = max(0, int(y_card + h_card * 0.05))
+    roi_top_end = min(frame.shape[0], int(y_card + h_card * 0.13))
+    roi_left = max(0, x_card)
+    roi_right = min(frame.shape[1], x_card + w_card)
+    
+    return frame[roi_top_start:roi_top_end, roi_left:roi_right]
+
+def clean_ocr_text(text):
+    # Clean up the text
+    clean_text = ''.join(c for c in text if c.isalpha())
+
+    # Basic validation
+    if len(clean_text) >= 2 and is_reasonable_text(clean_text):
+        return clean_text.title()
+    return None
+
+def upscale(img):
+    # Resize for better OCR accuracy
+    return cv2.resize(img, (0, 0), fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
+
+def fast_variants(gray):
+    """The two cheap binarizations of a grayscale title strip, upscaled for OCR"""
+    # Method 1: Otsu threshold
+    _, thresh1 = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+
+    # Method 2: Adaptive threshold
+    thresh2 = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                  cv2.THRESH_BINARY, 11, 2)
+    return [upscale(thresh1), upscale(thresh2)]
+
+def denoised_variant(gray):
+    # Method 3: Denoising + threshold
+    denoised = cv2.fastNlMeansDenoising(gray, None, 10, 7, 21)
+    _, thresh3 = cv2.threshold(denoised, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return upscale(thresh3)
+
+def read_title(roi):
+    """OCR a title strip: two fast variants in one batch, the slow denoised one only if they disagree"""
+    # Convert to grayscale
+    gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
+
+    # Both variants have the same size, so EasyOCR can recognize them as one batch
+    results = OCR_READER.get().readtext_batched(fast_variants(gray), detail=0)
+    texts = [' '.join(result).strip() for result in results]
+    names = [clean_ocr_text(text) for text in texts]
+    if names[0] and names[0] == names[1]:
+        return names[0]
+
+    # The denoised variant is slow, so it is only tried when the fast variants disagree
+    texts.append(' '.join(OCR_READER.get().readtext(denoised_variant(gray), detail=0)).strip())
+    names.append(clean_ocr_text(texts[-1]))
+
+    votes = Counter(name for name in names if name)
+    if votes and votes.most_common(1)[0][1] >= 2:
+        return votes.most_common(1)[0][0]
+
+    # Keep the longest or most promising text
+    return clean_ocr_text(max(texts, key=len))
+
+def cached_text(frame, card_contour):
+    """(cache key, name) of the card title: the name confirmed earlier for a title strip like this one, or None.
+
+    The key is None when there is no title strip or the cache is disabled.
+    """
+    if card_contour is None or OCR_CACHE.size <= 0:
+        return None, None
+    roi = title_roi(frame, card_contour)
+    if roi.size == 0:
+        return None, None
+    key = title_hash(roi)
+    return key, OCR_CACHE.get(key)
+
 def find_text(frame, card_contour):
     try:
         if card_contour is None:
             return None
-            
-        x_card, y_card, w_card, h_card = cv2.boundingRect(card_contour)
-        
-        # Expanded ROI to capture more of the text area
-        roi_top_start = max(0, int(y_card + h_card * 0.05))
-        roi_top_end = min(frame.shape[0], int(y_card + h_card * 0.13))
-        roi_left = max(0, x_card)
-        roi_right = min(frame.shape[1], x_card + w_card)
-        
-        roi = frame[roi_top_start:roi_top_end, roi_left:roi_right]
-        
+
+        roi = title_roi(frame, card_contour)
         if roi.size == 0:
             return None
 
         # Show the cropped ROI window for visualization
-        cv2.imshow("Cropped ROI", roi)
-        cv2.waitKey(1)  # Adjust delay as needed
-
-        # Convert to grayscale
-        gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
-        
-        # Try multiple preprocessing methods
-        processed_images = []
-
-        # Method 1: Otsu threshold
-        _, thresh1 = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-        processed_images.append(thresh1)
-
-        # Method 2: Adaptive threshold
-        thresh2 = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                                      cv2.THRESH_BINARY, 11, 2)
-        processed_images.append(thresh2)
-
-        # Method 3: Denoising + threshold
-        denoised = cv2.fastNlMeansDenoising(gray, None, 10, 7, 21)
-        _, thresh3 = cv2.threshold(denoised, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-        processed_images.append(thresh3)
-
-        best_text = ""
-        for img in processed_images:
-            # Resize for better OCR accuracy
-            scaled = cv2.resize(img, (0, 0), fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
-            # Run EasyOCR on the processed image
-            result = reader.readtext(scaled, detail=0)
-            text = ' '.join(result).strip()
-
-            # Keep the longest or most promising text
-            if len(text) > len(best_text):
-                best_text = text
-
-        # Clean up the text
-        clean_text = ''.join(c for c in best_text if c.isalpha())
-
-        # Basic validation
-        if len(clean_text) >= 2 and is_reasonable_text(clean_text):
-            return clean_text.title()
+        if SHOW_ROI:
+            cv2.imshow("Cropped ROI", roi)
+            cv2.waitKey(1)  # Adjust delay as needed
 
-        return None
+        return read_title(roi)
 
     except Exception as e:
         print(f"OCR Error: {str(e)}")
@@ -0,0 +1,181 @@
+import glob
+import logging
+import os
+import time
+import cv2
+import numpy as np
+from config import CARD_STABLE_FRAMES, CARD_MISSING_FRAMES, MAX_ATTEMPTS_NAME
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+# Frames a fed image waits for its card to be dispatched before the replay moves on without it
+FED_MAX_HOLD = 900
+
+class FrameSource:
+    """Frames with the cv2.VideoCapture interface (read, isOpened, release) plus where each came from.
+
+    live sources produce frames on their own clock, so a slow consumer should
+    drop stale ones; other sources wait for the consumer, so no frame is lost.
+    position and timestamp describe the last frame read.
+    """
+
+    live = False
+
+    def __init__(self, realtime=False):
+        self.realtime = realtime
+        self.position = -1
+        self.timestamp = 0.0
+        self.exhausted = False
+        self.clock_start = None
+
+    def isOpened(self):
+        return True
+
+    def read(self):
+        raise NotImplementedError
+
+    def release(self):
+        pass
+
+    def current_file(self):
+        return None
+
+    def origin(self):
+        """Where the last frame read came from, for per-card results"""
+        return {"source_frame": self.position, "source_time": round(self.timestamp, 3), "file": self.current_file()}
+
+    def card_dispatched(self, origin):
+        """The card seen in the frame from origin was sent off; True if the source took it away itself.
+
+        Only replays that stand in for the machine do.
+        """
+        return False
+
+    def _advance(self, timestamp):
+        self.position += 1
+        self.timestamp = timestamp
+        if self.realtime:
+            # Hold each frame back until its recorded time has passed
+            now = time.perf_counter()
+            if self.clock_start is None:
+                self.clock_start = now - timestamp
+            delay = self.clock_start + timestamp - now
+            if delay > 0:
+                time.sleep(delay)
+
+class CameraSource(FrameSource):
+    live = True
+
+    def __init__(self, index=0):
+        super().__init__()
+        self.capture = cv2.VideoCapture(index)
+        self.start = time.perf_counter()
+
+    def isOpened(self):
+        return self.capture.isOpened()
+
+    def read(self):
+        ret, frame = self.capture.read()
+        if ret:
+            self._advance(time.perf_counter() - self.start)
+        return ret, frame
+
+    def release(self):
+        self.capture.release()
+
+class VideoSource(FrameSource):
+    """A recorded video, as fast as it decodes or (realtime) at its recorded timing"""
+
+    def __init__(self, path, realtime=False):
+        super().__init__(realtime)
+        self.live = realtime
+        self.capture = cv2.VideoCapture(path)
+
+    def isOpened(self):
+        return self.capture.isOpened()
+
+    def read(self):
+        ret, frame = self.capture.read()
+        if not ret:
+            self.exhausted = True
+            return False, None
+        self._advance(self.capture.get(cv2.CAP_PROP_POS_MSEC) / 1000.0)
+        return True, frame
+
+    def release(self):
+        self.capture.release()
+
+class ImageDirSource(FrameSource):
+    """Still card photos played as a video: each is shown for hold frames, then gap blank frames.
+
+    The hold lets CardTracker see the card settle and the gap lets it see the
+    card leave, so every image is recognized exactly once. Both leave room for
+    the frames name detection reads while retrying (up to MAX_ATTEMPTS_NAME),
+    which the tracker never sees.
+
+    fed replays the images the way the machine feeds cards from its stack: with
+    no gap, each image showing until its card is dispatched (or for at most
+    FED_MAX_HOLD frames, so a card that is never recognized cannot stall it).
+    """
+
+    def __init__(self, path, fps=30.0, hold=CARD_STABLE_FRAMES + MAX_ATTEMPTS_NAME + 1,
+                 gap=CARD_MISSING_FRAMES + MAX_ATTEMPTS_NAME + 1, realtime=False, fed=False):
+        super().__init__(realtime)
+        self.live = realtime
+        self.files = sorted(f for f in glob.glob(os.path.join(path, "*")) if f.lower().endswith(IMAGE_EXTENSIONS))
+        self.fps = fps
+        self.hold = hold
+        self.gap = gap
+        self.fed = fed
+        self.fed_index = 0
+        self.fed_frames = 0
+        self.image = np.zeros((480, 640, 3), dtype=np.uint8)
+        self.image_index = None
+
+    def isOpened(self):
+        return bool(self.files)
+
+    def current_file(self):
+        return self.files[self.image_index] if self.image_index is not None else None
+
+    def card_dispatched(self, origin):
+        # Only the card on show moves the feed on, however often its dispatch is reported
+        if self.fed and origin.get("file") == self.files[min(self.fed_index, len(self.files) - 1)]:
+            self.fed_index += 1
+            return True
+        return False
+
+    def read(self):
+        if self.fed:
+            if self.fed_index == self.image_index:
+                self.fed_frames += 1
+                if self.fed_frames > FED_MAX_HOLD:
+                    logger.warning(f"{self.current_file()} was never dispatched, moving on")
+                    self.fed_index += 1
+            image_index, offset = self.fed_index, 0
+        else:
+            image_index, offset = divmod(self.position + 1, self.hold + self.gap)
+        if image_index >= len(self.files):
+            self.exhausted = True
+            return False, None
+        if image_index != self.image_index:
+            self.image_index = image_index
+            self.fed_frames = 0
+            image = cv2.imread(self.files[image_index])
+            if image is None:
+                logger.warning(f"Could not read {self.files[image_index]}, showing a blank frame instead")
+                image = np.zeros_like(self.image)
+            self.image = image
+        # A fresh array per frame: consumers tell frames apart by identity
+        frame = self.image.copy() if offset < self.hold else np.zeros_like(self.image)
+        self._advance((self.position + 1) / self.fps)
+        return True, frame
+
+def open_source(spec, realtime=False, fed=False):
+    """Camera index ("0"), image directory (fed: back to back, as the machine feeds cards) or video file"""
+    if spec is None or str(spec).isdigit():
+        return CameraSource(int(spec or 0))
+    if os.path.isdir(spec):
+        return ImageDirSource(spec, realtime=realtime, fed=fed)
+    return VideoSource(spec, realtime)
@@ -0,0 +1,377 @@
+import math
+import os
+import struct
+import numpy as np
+
+# Compiled hash file: fixed header, (3, N, W) little-endian uint64 words, N fixed-width ASCII ids
+INDEX_MAGIC = b"MOSSHASH"
+INDEX_VERSION = 1
+INDEX_HEADER = struct.Struct("<8sIQII")
+INDEX_HEADER_SIZE = 32
+
+if hasattr(np, "bitwise_count"):
+    def popcount64(words):
+        return np.bitwise_count(words)
+else:
+    _POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def popcount64(words):
+        counts = _POPCOUNT_TABLE[np.ascontiguousarray(words).view(np.uint8)]
+        return counts.reshape(words.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+def hex_to_words(hex_str):
+    """Pack a hex pHash string (as written by Update.py) into big-endian uint64 words"""
+    if len(hex_str) % 16:
+        raise ValueError(f"Hash length {len(hex_str)} is not a multiple of 64 bits")
+    return np.frombuffer(bytes.fromhex(hex_str), dtype=">u8").astype(np.uint64)
+
+def hash_to_words(image_hash):
+    return hex_to_words(str(image_hash))
+
+def query_words(r_hash, g_hash, b_hash):
+    """Stack the three channel hashes of an image into a (3, words) query"""
+    return np.stack([hash_to_words(h) for h in (r_hash, g_hash, b_hash)])
+
+class CardIdTable:
+    """Read-only view over the fixed-width id column of a compiled hash file"""
+
+    def __init__(self, raw_ids):
+        self.raw_ids = raw_ids
+
+    def __len__(self):
+        return len(self.raw_ids)
+
+    def __getitem__(self, row):
+        return self.raw_ids[row].decode('ascii')
+
+    def __iter__(self):
+        return (raw.decode('ascii') for raw in self.raw_ids)
+
+class HashIndex:
+    """RGB pHashes of every card stored as packed uint64 matrices.
+
+    words has shape (3, N, W): one contiguous (N, W) matrix per colour channel,
+    W = hash bits / 64. Distances are the average Hamming distance over the
+    three channels, the same score the old per-card ImageHash loop produced.
+    """
+
+    def __init__(self, card_ids, words):
+        self.card_ids = card_ids
+        self.words = words
+        self._rows = None
+
+    @classmethod
+    def from_hash_db(cls, hash_db):
+        card_ids = []
+        rows = []
+        for card_id, h in hash_db.items():
+            r_phash = h.get('r_phash')
+            g_phash = h.get('g_phash')
+            b_phash = h.get('b_phash')
+            if all([r_phash, g_phash, b_phash]):
+                try:
+                    rows.append([hex_to_words(r_phash), hex_to_words(g_phash), hex_to_words(b_phash)])
+                    card_ids.append(card_id)
+                except ValueError:
+                    print(f"Invalid hash for card {card_id}. Skipping.")
+        if rows and len({row[0].size for row in rows}) > 1:
+            raise ValueError("Hash database mixes different hash sizes")
+        width = rows[0][0].size if rows else 4
+        words = np.empty((3, len(rows), width), dtype=np.uint64)
+        for i, (r, g, b) in enumerate(rows):
+            words[0, i], words[1, i], words[2, i] = r, g, b
+        return cls(card_ids, words)
+
+    @classmethod
+    def load(cls, path):
+        """Memory-map a compiled hash file read-only; pages are shared between processes"""
+        with open(path, 'rb') as f:
+            magic, version, count, width, id_width = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise ValueError(f"{path} is not a version {INDEX_VERSION} compiled hash file")
+        words_offset = INDEX_HEADER_SIZE
+        ids_offset = words_offset + 3 * count * width * 8
+        if count == 0:
+            return cls([], np.empty((3, 0, width), dtype=np.uint64))
+        words = np.memmap(path, dtype='<u8', mode='r', offset=words_offset, shape=(3, count, width))
+        raw_ids = np.memmap(path, dtype=f'S{id_width}', mode='r', offset=ids_offset, shape=(count,))
+        return cls(CardIdTable(raw_ids), words)
+
+    def save(self, path):
+        """Write the compiled hash file atomically next to its final location.
+
+        Returns False when the old file could not be replaced: Windows refuses
+        to replace a file another process (e.g. a second Main) still has mapped.
+        The old file is kept and the new build is dropped.
+        """
+        ids = [str(card_id).encode('ascii') for card_id in self.card_ids]
+        id_width = max((len(card_id) for card_id in ids), default=1)
+        count, width = self.words.shape[1], self.words.shape[2]
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, count, width, id_width).ljust(INDEX_HEADER_SIZE, b"\0"))
+            f.write(np.ascontiguousarray(self.words, dtype='<u8').tobytes())
+            f.write(np.array(ids, dtype=f'S{id_width}').tobytes())
+        try:
+            os.replace(tmp_path, path)
+        except PermissionError:
+            os.remove(tmp_path)
+            return False
+        return True
+
+    def __len__(self):
+        return self.words.shape[1]
+
+    def restricted(self, mask):
+        """A compact index holding only the rows where mask is True, for scanning eligible cards only.
+
+        The rows are copied into one contiguous matrix (about 96 bytes a row):
+        scanning it beats gathering the selected rows out of the full index
+        even when nearly every row is eligible. A mask that allows every row
+        returns this index itself, so its (mapped) words stay shared.
+        """
+        rows = np.flatnonzero(mask)
+        if len(rows) == len(self):
+            return self
+        words = np.ascontiguousarray(self.words[:, rows, :])
+        return HashIndex(RowSubsetIds(self.card_ids, rows), words)
+
+    def row_of(self, card_id):
+        if self._rows is None:
+            self._rows = {card_id: row for row, card_id in enumerate(self.card_ids)}
+        return self._rows.get(card_id)
+
+    def summed_distances(self, query, rows=None):
+        """Integer sum of the r/g/b Hamming distances for every row (or only the given rows).
+
+        query is a single (3, W) hash or a (Q, 3, W) stack; a stack is scored in
+        the same pass over the index and gives a (Q, rows) result.
+        """
+        query = np.asarray(query, dtype=np.uint64)
+        if query.ndim == 2:
+            return self.summed_distances(query[None], rows)[0]
+        selector = slice(None) if rows is None else rows
+        total = np.zeros((len(query), len(self) if rows is None else len(rows)), dtype=np.uint16)
+        # One word column at a time: a single XOR+popcount pass with no large temporaries
+        for channel in range(self.words.shape[0]):
+            for word in range(self.words.shape[2]):
+                column = self.words[channel, selector, word]
+                total += popcount64(column[None, :] ^ query[:, channel, word, None])
+        return total
+
+    def distances(self, query):
+        return self.summed_distances(query) / 3.0
+
+    def top_k(self, query, k=5):
+        """Return the k closest (card_id, avg_distance) pairs, best first"""
+        return self.top_k_many([query], k)[0]
+
+    def top_k_many(self, queries, k=5, max_distance=None, rows=None):
+        """top_k for several queries scored in one pass, optionally dropping rows past max_distance.
+
+        rows restricts the search to those index rows (e.g. the printings of one name).
+        """
+        if rows is not None:
+            rows = np.asarray(rows, dtype=np.int64)
+        if len(self) == 0 or k <= 0 or (rows is not None and len(rows) == 0):
+            return [[] for _ in queries]
+        results = []
+        for summed in self.summed_distances(np.asarray(queries, dtype=np.uint64), rows):
+            positions = select_nearest(summed, k, rows)
+            if max_distance is not None:
+                positions = positions[summed[positions] <= int(math.floor(max_distance * 3))]
+            found = positions if rows is None else rows[positions]
+            results.append([(self.card_ids[row], float(dist) / 3.0) for row, dist in zip(found, summed[positions])])
+        return results
+
+    def best_match(self, query):
+        if len(self) == 0:
+            return None, float('inf')
+        summed = self.summed_distances(query)
+        row = int(np.argmin(summed))
+        return self.card_ids[row], float(summed[row]) / 3.0
+
+class RowSubsetIds:
+    """Card ids of the selected rows of another id table, without copying them"""
+
+    def __init__(self, card_ids, rows):
+        self.card_ids = card_ids
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, row):
+        return self.card_ids[int(self.rows[row])]
+
+    def __iter__(self):
+        return (self.card_ids[int(row)] for row in self.rows)
+
+def select_nearest(summed, k, rows=None):
+    """Positions of the k smallest distances by partial selection, ordered by (distance, row).
+
+    rows gives the index row of each entry of summed (defaults to its position).
+    """
+    if rows is None:
+        rows = np.arange(len(summed))
+    k = min(k, len(summed))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(summed):
+        # Keep every entry tied with the k-th distance so ties resolve by row order
+        cutoff = summed[np.argpartition(summed, k - 1)[k - 1]]
+        keep = np.flatnonzero(summed <= cutoff)
+    else:
+        keep = np.arange(len(summed))
+    return keep[np.lexsort((rows[keep], summed[keep]))][:k]
+
+CHUNK_BITS = 16
+CHUNKS_PER_WORD = 64 // CHUNK_BITS
+# Every 16-bit flip pattern ordered by popcount, so the masks at radius <= r are a prefix
+_FLIP_MASKS = np.arange(1 << CHUNK_BITS, dtype=np.uint32)
+_FLIP_MASKS = _FLIP_MASKS[np.argsort(popcount64(_FLIP_MASKS.astype(np.uint64)), kind='stable')]
+_FLIP_COUNTS = np.cumsum([math.comb(CHUNK_BITS, r) for r in range(CHUNK_BITS + 1)])
+
+def _chunks(words):
+    """Split (..., W) uint64 words into (..., W * 4) 16-bit substrings"""
+    shifts = np.arange(CHUNKS_PER_WORD, dtype=np.uint64) * np.uint64(CHUNK_BITS)
+    parts = (words[..., None] >> shifts) & np.uint64(0xFFFF)
+    return parts.reshape(words.shape[:-1] + (-1,)).astype(np.uint32)
+
+class MultiIndexHash:
+    """Multi-index hashing over 16-bit substrings of the concatenated r/g/b pHash.
+
+    With m substrings, any row whose summed distance is below m * (r + 1) differs
+    from the query by at most r bits in at least one substring, so probing every
+    substring bucket within radius r finds it. Small radii only touch a handful
+    of buckets, so only radii well below the cost of a full scan are probed;
+    a query with nothing that close falls back to the exhaustive kernel of the
+    underlying HashIndex.
+    """
+
+    def __init__(self, index, max_probe_fraction=0.25):
+        self.index = index
+        self.max_probe_fraction = max_probe_fraction
+        words = np.asarray(index.words)
+        chunks = [_chunks(words[channel]) for channel in range(words.shape[0])]
+        chunks = np.concatenate(chunks, axis=1) if chunks else np.empty((0, 0), dtype=np.uint32)
+        self.substrings = chunks.shape[1]
+        count = len(index)
+        # Bucket tables for all substrings laid end to end: rows of bucket b of
+        # substring s are orders[offsets[s, b]:offsets[s, b + 1]]
+        self.orders = np.empty(self.substrings * count, dtype=np.uint32)
+        self.offsets = np.empty((self.substrings, (1 << CHUNK_BITS) + 1), dtype=np.int64)
+        for substring, column in enumerate(chunks.T):
+            order = np.argsort(column, kind='stable')
+            self.orders[substring * count:(substring + 1) * count] = order
+            bounds = np.searchsorted(column[order], np.arange((1 << CHUNK_BITS) + 1))
+            self.offsets[substring] = bounds + substring * count
+
+    def _query_chunks(self, queries):
+        """(Q, substrings) chunks of a (Q, 3, W) query stack"""
+        queries = np.asarray(queries, dtype=np.uint64)
+        return _chunks(queries).reshape(len(queries), -1)
+
+    def _max_radius(self):
+        """Largest per-substring radius still cheaper than scanning the whole index"""
+        budget = self.max_probe_fraction * len(self.index)
+        radius = -1
+        while radius < CHUNK_BITS and self.substrings * _FLIP_COUNTS[radius + 1] <= budget:
+            radius += 1
+        return radius
+
+    def _probe(self, query_chunks, radius, seen):
+        """Rows not in seen sharing a bucket with any of the queries at exactly this substring radius.
+
+        The rows are added to seen (a boolean row mask) and returned in row order.
+        """
+        start = 0 if radius == 0 else _FLIP_COUNTS[radius - 1]
+        flips = _FLIP_MASKS[start:_FLIP_COUNTS[radius]]
+        buckets = query_chunks[:, :, None] ^ flips[None, None, :]
+        substrings = np.arange(self.substrings)[None, :, None]
+        starts = self.offsets[substrings, buckets].ravel()
+        lengths = self.offsets[substrings, buckets + 1].ravel() - starts
+        total = int(lengths.sum())
+        if total == 0:
+            return np.empty(0, dtype=np.int64)
+        # Expand the [start, start + length) ranges into one flat gather
+        ends = np.cumsum(lengths)
+        positions = np.arange(total) + np.repeat(starts - (ends - lengths), lengths)
+        # Deduplicate through a row mask: much cheaper than sorting the gathered rows
+        fresh = np.zeros(len(seen), dtype=bool)
+        fresh[self.orders[positions]] = True
+        fresh &= ~seen
+        seen |= fresh
+        return np.flatnonzero(fresh)
+
+    def within(self, query, max_distance):
+        """All (card_id, avg_distance) pairs with avg distance <= max_distance, best first"""
+        limit = int(math.floor(max_distance * 3))
+        radius = limit // self.substrings if self.substrings else 0
+        if radius > self._max_radius():
+            summed = self.index.summed_distances(query)
+            rows = np.flatnonzero(summed <= limit)
+            dists = summed[rows]
+        else:
+            query_chunks = self._query_chunks([query])
+            seen = np.zeros(len(self.index), dtype=bool)
+            rows = np.sort(np.concatenate([self._probe(query_chunks, r, seen) for r in range(radius + 1)]))
+            dists = self.index.summed_distances(query, rows)
+            keep = dists <= limit
+            rows, dists = rows[keep], dists[keep]
+        order = np.lexsort((rows, dists))
+        return [(self.index.card_ids[rows[i]], float(dists[i]) / 3.0) for i in order]
+
+    def top_k_bounded(self, queries, k, max_distance):
+        """The k closest (card_id, avg_distance) pairs within max_distance of each query, and the bound searched.
+
+        All queries (e.g. the orientations of one card) are probed together, one
+        radius at a time, until k rows are known to be closer than
+        substrings * (radius + 1) or the affordable radii run out. The lists then
+        hold only rows below that bound, returned as an average distance: a list
+        shorter than k means "no further candidate within bound", nothing is
+        known beyond it. The bound is None when the lists are complete up to
+        max_distance, as after the exhaustive scan that runs when no query has
+        any row below the largest affordable bound.
+        """
+        queries = np.asarray(queries, dtype=np.uint64)
+        if len(self.index) == 0 or k <= 0:
+            return [[] for _ in queries], None
+        limit = int(math.floor(max_distance * 3))
+        max_radius = self._max_radius()
+        if max_radius < 0:
+            return self.index.top_k_many(queries, k, max_distance), None
+        query_chunks = self._query_chunks(queries)
+        seen = np.zeros(len(self.index), dtype=bool)
+        found_rows, found_dists = [], []
+        for radius in range(max_radius + 1):
+            rows = self._probe(query_chunks, radius, seen)
+            found_rows.append(rows)
+            found_dists.append(self.index.summed_distances(queries, rows))
+            # Anything closer than substrings * (radius + 1) to any query has now been seen
+            exact_below = self.substrings * (radius + 1)
+            dists = np.concatenate(found_dists, axis=1)
+            if limit < exact_below or np.count_nonzero(dists < exact_below) >= k:
+                break
+        if limit < exact_below:
+            bound, cutoff = None, limit
+        elif np.any(dists < exact_below):
+            bound, cutoff = exact_below / 3.0, exact_below - 1
+        else:
+            return self.index.top_k_many(queries, k, max_distance), None
+        rows = np.concatenate(found_rows)
+        results = []
+        for summed in dists:
+            keep = np.flatnonzero(summed <= cutoff)
+            order = keep[select_nearest(summed[keep], k, rows[keep])]
+            results.append([(self.index.card_ids[rows[i]], float(summed[i]) / 3.0) for i in order])
+        return results, bound
+
+    def top_k(self, query, k, max_distance):
+        """The k closest (card_id, avg_distance) pairs of one query, as far as top_k_bounded searched"""
+        return self.top_k_bounded([query], k, max_distance)[0][0]
+
+    def nearest(self, query, max_distance):
+        """Best (card_id, avg_distance) within max_distance, or (None, inf) for no match"""
+        matches = self.top_k(query, 1, max_distance)
+        return matches[0] if matches else (None, float('inf'))
@@ -1,56 +1,153 @@
-import json
 import os
+import time
+from collections import namedtuple
 import imagehash
-from config import HASH_DB_PATH
-
-HASH_DB = {}
-if os.path.exists(HASH_DB_PATH):
-    with open(HASH_DB_PATH, 'r', encoding='utf-8') as f:
-        HASH_DB = json.load(f)
-
-PRECOMPUTED_HASHES = []
-for card_id, h in HASH_DB.items():
-    r_phash = h.get('r_phash')
-    g_phash = h.get('g_phash')
-    b_phash = h.get('b_phash')
-    if all([r_phash, g_phash, b_phash]):
-        try:
-            r = imagehash.hex_to_hash(r_phash)
-            g = imagehash.hex_to_hash(g_phash)
-            b = imagehash.hex_to_hash(b_phash)
-            PRECOMPUTED_HASHES.append((card_id, r, g, b))
-        except ValueError:
-            print(f"Invalid hash for card {card_id}. Skipping.")
+import numpy as np
+from cards import build_eligibility_mask, get_card_name
+from config import HASH_DB_PATH, HASH_DELTA_PATH, HASH_INDEX_PATH, HASH_SEARCH_MODE, MAX_DISTANCE_THRESHOLD, RECOGNITION_TOP_K, HASH_DECISIVE_DISTANCE, HASH_DECISIVE_MARGIN
+from hashindex import HashIndex, MultiIndexHash, query_words
+from hashstore import load_hash_db
+from startup import LazyResource
 
-def hash_image_color(img, hash_size=16):
+def compile_hash_index(json_path=HASH_DB_PATH, index_path=HASH_INDEX_PATH, delta_path=HASH_DELTA_PATH):
+    """Convert card_hashes.json plus its delta log into the compiled, memory-mappable hash file"""
+    hash_db = load_hash_db(json_path, delta_path)
+    index = HashIndex.from_hash_db(hash_db)
+    if not index.save(index_path):
+        print(f"Could not replace {index_path}, it is open in another program; keeping the existing file "
+              f"until that program exits.")
+        return False
+    print(f"Compiled {len(index)} card hashes into {index_path}.")
+    return True
+
+def load_hash_index(json_path=HASH_DB_PATH, index_path=HASH_INDEX_PATH, delta_path=HASH_DELTA_PATH):
+    """Open the compiled hash file, rebuilding it first when the JSON or its delta log is newer"""
+    start_time = time.time()
+    sources = [path for path in (json_path, delta_path) if os.path.exists(path)]
+    if sources:
+        newest = max(os.path.getmtime(path) for path in sources)
+        if not os.path.exists(index_path) or newest > os.path.getmtime(index_path):
+            compile_hash_index(json_path, index_path, delta_path)
+    elif not os.path.exists(index_path):
+        return HashIndex.from_hash_db({})
+    index = HashIndex.load(index_path)
+    print(f"Loaded {len(index)} card hashes from {index_path} in {time.time() - start_time:.3f}s.")
+    return index
+
+def load_eligible_index():
+    index = HASH_INDEX.get()
+    return index.restricted(build_eligibility_mask(index.card_ids))
+
+def load_hash_search():
+    index = ACTIVE_INDEX.get()
+    return MultiIndexHash(index) if HASH_SEARCH_MODE == "mih" else None
+
+# Loaded on first use (or warmed up in the background by Main)
+HASH_INDEX = LazyResource("hash index", load_hash_index)
+# Index actually searched: the rows of HASH_INDEX allowed by the eligibility mask
+ACTIVE_INDEX = LazyResource("eligible hash rows", load_eligible_index)
+HASH_SEARCH = LazyResource("multi-index hash", load_hash_search)
+
+# Result of recognize_card: margin is the distance of the closest candidate with another name
+# minus the best distance (a lower bound on it when no such candidate was among those found);
+# queries are the hashed orientations, for matching the same crop again without rehashing it
+Recognition = namedtuple('Recognition', ['card_id', 'distance', 'orientation', 'margin', 'candidates', 'queries'])
+
+def hash_query(img, hash_size=16):
     img = img.convert('RGB')
     r, g, b = img.split()
     r_hash = imagehash.phash(r, hash_size)
     g_hash = imagehash.phash(g, hash_size)
     b_hash = imagehash.phash(b, hash_size)
-    best_match_id = None
-    min_distance = float('inf')
-    for card_id, stored_r, stored_g, stored_b in PRECOMPUTED_HASHES:
-        r_dist = r_hash - stored_r
-        g_dist = g_hash - stored_g
-        b_dist = b_hash - stored_b
-        avg_dist = (r_dist + g_dist + b_dist) / 3.0
-        if avg_dist < min_distance:
-            min_distance = avg_dist
-            best_match_id = card_id
-    return best_match_id, min_distance
+    return query_words(r_hash, g_hash, b_hash)
+
+def hash_image_color(img, hash_size=16):
+    return ACTIVE_INDEX.get().best_match(hash_query(img, hash_size))
 
 def compute_distances_for_image(img, hash_size=16):
-    img = img.convert('RGB')
-    r, g, b = img.split()
-    r_hash = imagehash.phash(r, hash_size)
-    g_hash = imagehash.phash(g, hash_size)
-    b_hash = imagehash.phash(b, hash_size)
-    distances = []
-    for card_id, stored_r, stored_g, stored_b in PRECOMPUTED_HASHES:
-        r_dist = r_hash - stored_r
-        g_dist = g_hash - stored_g
-        b_dist = b_hash - stored_b
-        avg_dist = (r_dist + g_dist + b_dist) / 3.0
-        distances.append((card_id, avg_dist))
-    return distances
+    distances = ACTIVE_INDEX.get().distances(hash_query(img, hash_size))
+    return list(zip(ACTIVE_INDEX.get().card_ids, distances.tolist()))
+
+def top_matches_for_image(img, k=5, hash_size=16):
+    return ACTIVE_INDEX.get().top_k(hash_query(img, hash_size), k)
+
+def find_best_match(img, max_distance=MAX_DISTANCE_THRESHOLD, hash_size=16):
+    """Best (card_id, distance) within max_distance, or (None, inf) when nothing is close enough"""
+    query = hash_query(img, hash_size)
+    search = HASH_SEARCH.get()
+    if search is not None:
+        return search.nearest(query, max_distance)
+    card_id, distance = ACTIVE_INDEX.get().best_match(query)
+    if distance > max_distance:
+        return None, float('inf')
+    return card_id, distance
+
+def find_matches_within(img, max_distance=MAX_DISTANCE_THRESHOLD, hash_size=16):
+    query = hash_query(img, hash_size)
+    search = HASH_SEARCH.get()
+    if search is not None:
+        return search.within(query, max_distance)
+    index = ACTIVE_INDEX.get()
+    return [(card_id, distance) for card_id, distance in index.top_k(query, len(index))
+            if distance <= max_distance]
+
+def candidate_rows(card_ids):
+    """Rows of the searched index holding the given cards, skipping cards it does not contain"""
+    index = ACTIVE_INDEX.get()
+    rows = (index.row_of(card_id) for card_id in card_ids)
+    return np.array(sorted({row for row in rows if row is not None}), dtype=np.int64)
+
+def hash_orientations(orientations, hash_size=16):
+    """The query words of each orientation (label -> PIL image), as recognize_card takes them in queries"""
+    return {label: hash_query(img, hash_size) for label, img in orientations.items()}
+
+def recognize_card(orientations=None, k=RECOGNITION_TOP_K, max_distance=MAX_DISTANCE_THRESHOLD, allowed=None, hash_size=16, rows=None, queries=None):
+    """Hash each orientation once, score them all in one pass and keep the best.
+
+    orientations maps a label such as "upright" to a PIL image. queries maps
+    the labels to words hashed before (hash_orientations, or the queries of an
+    earlier Recognition of the same crop) and replaces orientations. allowed is
+    an optional card_id predicate applied to the top-k candidates. rows (from
+    candidate_rows) limits the scan to a few printings instead of every card.
+    """
+    if queries is None:
+        queries = hash_orientations(orientations, hash_size)
+    labels = list(queries)
+    stacked = np.stack([queries[label] for label in labels])
+    search = HASH_SEARCH.get()
+    # bound: the multi-index hash only knows the candidates closer than this
+    bound = None
+    if rows is not None:
+        candidate_lists = ACTIVE_INDEX.get().top_k_many(stacked, k, max_distance, rows)
+    elif search is not None:
+        candidate_lists, bound = search.top_k_bounded(stacked, k, max_distance)
+    else:
+        candidate_lists = ACTIVE_INDEX.get().top_k_many(stacked, k, max_distance)
+    if allowed is not None:
+        candidate_lists = [[(cid, dist) for cid, dist in candidates if allowed(cid)] for candidates in candidate_lists]
+    best_label, best_candidates = None, []
+    for label, candidates in zip(labels, candidate_lists):
+        if candidates and (not best_candidates or candidates[0][1] < best_candidates[0][1]):
+            best_label, best_candidates = label, candidates
+    if not best_candidates:
+        return Recognition(None, float('inf'), None, 0.0, [], queries)
+    best_id, best_dist = best_candidates[0]
+    # Reprints of a card often share its art and hash almost alike; only a card with another name is a rival
+    best_name = get_card_name(best_id) or best_id
+    runner_up = next((dist for card_id, dist in best_candidates[1:] if (get_card_name(card_id) or card_id) != best_name), None)
+    if runner_up is not None:
+        margin = runner_up - best_dist
+    elif len(best_candidates) >= k:
+        # All k candidates are printings of the best card: any other name is at least as far as the last
+        margin = best_candidates[-1][1] - best_dist
+    elif bound is not None:
+        # No other name within the searched bound: it is at least that far away
+        margin = bound - best_dist
+    else:
+        # No other name inside max_distance means nothing else is even a plausible match
+        margin = float('inf')
+    return Recognition(best_id, best_dist, best_label, margin, best_candidates, queries)
+
+def is_decisive_match(match, max_distance=HASH_DECISIVE_DISTANCE, min_margin=HASH_DECISIVE_MARGIN):
+    """Whether a Recognition is close and unambiguous enough to trust without reading the name"""
+    return match.card_id is not None and match.distance <= max_distance and match.margin >= min_margin
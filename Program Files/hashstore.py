@@ -0,0 +1,111 @@
+import json
+import os
+
+class HashDeltaLog:
+    """Card hashes changed since card_hashes.json was last compacted, as an append-only JSON lines file.
+
+    Each line is {"id": ..., "r_phash": ..., "g_phash": ..., "b_phash": ...},
+    or {"id": ..., "deleted": true} for a card removed from the hash DB. Later
+    lines win. Batches are fsynced as they are appended, so an interrupted
+    update keeps every batch written before it stopped.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def _open(self):
+        if self.file is None:
+            cut_off = False
+            if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+                with open(self.path, 'rb') as f:
+                    f.seek(-1, os.SEEK_END)
+                    cut_off = f.read(1) != b"\n"
+            self.file = open(self.path, 'a', encoding='utf-8')
+            if cut_off:
+                # Start after a line cut off by a crash instead of continuing it
+                self.file.write("\n")
+        return self.file
+
+    def append(self, hashes):
+        """Add a batch of {card_id: {'r_phash', 'g_phash', 'b_phash'} or None (removed)}"""
+        if not hashes:
+            return
+        f = self._open()
+        for card_id, h in hashes.items():
+            entry = {"id": card_id, "deleted": True} if h is None else {"id": card_id, **h}
+            f.write(json.dumps(entry) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+    def remove(self, card_ids):
+        self.append(dict.fromkeys(card_ids))
+
+    def entries(self):
+        """(card_id, hashes or None) in the order written; a line cut off by a crash is skipped"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    print(f"Skipping unreadable line {line_number} of {self.path}.")
+                    continue
+                card_id = entry.pop("id")
+                yield card_id, None if entry.get("deleted") else entry
+
+    def __len__(self):
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path, 'rb') as f:
+            return sum(1 for _ in f)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def clear(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def read_base_hashes(json_path):
+    if not os.path.exists(json_path):
+        return {}
+    with open(json_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def apply_delta(hash_db, delta_path):
+    """Replay the delta log onto hash_db in place; returns the number of entries applied"""
+    applied = 0
+    for card_id, h in HashDeltaLog(delta_path).entries():
+        if h is None:
+            hash_db.pop(card_id, None)
+        else:
+            hash_db[card_id] = h
+        applied += 1
+    return applied
+
+def load_hash_db(json_path, delta_path):
+    """The current hash DB: card_hashes.json with its delta log applied"""
+    hash_db = read_base_hashes(json_path)
+    apply_delta(hash_db, delta_path)
+    return hash_db
+
+def compact_hash_db(json_path, delta_path):
+    """Merge the delta log into card_hashes.json and start a new, empty log.
+
+    The JSON is replaced atomically before the log is removed; a crash in
+    between only replays entries the JSON already holds.
+    """
+    hash_db = load_hash_db(json_path, delta_path)
+    tmp_path = json_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(hash_db, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, json_path)
+    HashDeltaLog(delta_path).clear()
+    return len(hash_db)
@@ -0,0 +1,145 @@
+import csv
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+class Histogram:
+    """Count, sum and max of every observation, plus percentiles over the most recent window.
+
+    Observing is an append under a lock, so it is cheap enough for every frame;
+    sorting only happens when the percentiles are exported.
+    """
+
+    def __init__(self, window=2048):
+        self.lock = threading.Lock()
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value):
+        with self.lock:
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+            self.recent.append(value)
+
+    def percentiles(self, quantiles=QUANTILES):
+        with self.lock:
+            values = sorted(self.recent)
+        if not values:
+            return {q: 0.0 for q in quantiles}
+        # Nearest-rank percentiles
+        return {q: values[max(0, math.ceil(q * len(values)) - 1)] for q in quantiles}
+
+class Metrics:
+    """Named counters and histograms, exported periodically to a text (Prometheus) or CSV file"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.exporter = None
+        self.stop_event = threading.Event()
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def value(self, name):
+        return self.counters.get(name, 0)
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+        return histogram
+
+    def observe(self, name, value):
+        self.histogram(name).observe(value)
+
+    @contextmanager
+    def timer(self, name):
+        """Time a block into the histogram name (seconds)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self):
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = dict(self.histograms)
+        summaries = {}
+        for name, histogram in histograms.items():
+            summaries[name] = {"count": histogram.count, "sum": histogram.sum, "max": histogram.max,
+                               **{f"p{int(q * 100)}": value for q, value in histogram.percentiles().items()}}
+        return {"counters": counters, "histograms": summaries}
+
+    def to_text(self):
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in sorted(snapshot["counters"].items()):
+            lines += [f"# TYPE {name} counter", f"{name} {value}"]
+        for name, summary in sorted(snapshot["histograms"].items()):
+            lines.append(f"# TYPE {name} summary")
+            for q in QUANTILES:
+                lines.append(f'{name}{{quantile="{q}"}} {summary[f"p{int(q * 100)}"]:.6f}')
+            lines += [f"{name}_sum {summary['sum']:.6f}", f"{name}_count {summary['count']}"]
+        return "\n".join(lines) + "\n"
+
+    def write(self, path, fmt="text"):
+        """Replace path with the current text-format metrics, or append a timestamped row per metric to a CSV"""
+        if fmt == "csv":
+            snapshot = self.snapshot()
+            new_file = not os.path.exists(path)
+            now = time.strftime("%Y-%m-%dT%H:%M:%S")
+            with open(path, 'a', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                if new_file:
+                    writer.writerow(["time", "name", "type", "count", "sum", "p50", "p95", "p99", "max"])
+                for name, value in sorted(snapshot["counters"].items()):
+                    writer.writerow([now, name, "counter", value, "", "", "", "", ""])
+                for name, s in sorted(snapshot["histograms"].items()):
+                    writer.writerow([now, name, "histogram", s["count"], f"{s['sum']:.6f}", f"{s['p50']:.6f}",
+                                     f"{s['p95']:.6f}", f"{s['p99']:.6f}", f"{s['max']:.6f}"])
+        else:
+            tmp_path = path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(self.to_text())
+            os.replace(tmp_path, path)
+
+    def start_exporter(self, path, fmt="text", interval=10.0):
+        """Write the metrics every interval seconds from a daemon thread until stop_exporter()"""
+        def export():
+            while not self.stop_event.wait(interval):
+                try:
+                    self.write(path, fmt)
+                except OSError as e:
+                    logger.error(f"Could not write metrics to {path}: {e}")
+
+        self.exporter = (path, fmt, threading.Thread(target=export, name="metrics-exporter", daemon=True))
+        self.exporter[2].start()
+
+    def stop_exporter(self):
+        """Stop the exporter and write a final snapshot"""
+        if self.exporter is None:
+            return
+        path, fmt, thread = self.exporter
+        self.stop_event.set()
+        thread.join(1.0)
+        self.write(path, fmt)
+        self.exporter = None
+
+METRICS = Metrics()
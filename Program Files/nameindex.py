@@ -0,0 +1,66 @@
+from collections import Counter, defaultdict
+
+def normalize_name(name):
+    """Reduce a card name or OCR reading to lowercase letters, the form clean_ocr_text produces"""
+    return ''.join(c for c in name if c.isalpha()).lower()
+
+def trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class NameIndex:
+    """Trigram index from normalized card names to the ids of their printings.
+
+    Every face of a multi-face card ("A // B") is indexed as well as the full
+    name, since the title strip only shows the face in front of the camera.
+    """
+
+    def __init__(self, id_names):
+        ids = defaultdict(list)
+        for card_id, name in id_names:
+            if not name:
+                continue
+            faces = [name] + (name.split(" // ") if " // " in name else [])
+            for face in faces:
+                key = normalize_name(face)
+                if key:
+                    ids[key].append(card_id)
+        self.ids = dict(ids)
+        self.keys = list(self.ids)
+        self.gram_counts = []
+        postings = defaultdict(list)
+        for position, key in enumerate(self.keys):
+            grams = trigrams(key)
+            self.gram_counts.append(len(grams))
+            for gram in grams:
+                postings[gram].append(position)
+        self.postings = dict(postings)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup(self, text, limit=3, min_score=0.6):
+        """(name key, score) pairs for text, best first; score is the Dice overlap of trigrams"""
+        key = normalize_name(text or '')
+        if not key:
+            return []
+        if key in self.ids:
+            return [(key, 1.0)]
+        grams = trigrams(key)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+        scored = []
+        for position, count in shared.items():
+            score = 2.0 * count / (len(grams) + self.gram_counts[position])
+            if score >= min_score:
+                scored.append((score, self.keys[position]))
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return [(name, score) for score, name in scored[:limit]]
+
+    def card_ids(self, text, limit=3, min_score=0.6):
+        """Ids of every printing of the names matching text, or None when no name matches"""
+        matches = self.lookup(text, limit, min_score)
+        if not matches:
+            return None
+        return [card_id for name, _ in matches for card_id in self.ids[name]]
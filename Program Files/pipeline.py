@@ -0,0 +1,122 @@
+import logging
+import queue
+import threading
+import time
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# Sentinel passed down the pipeline to shut every stage down in order
+STOP = object()
+
+class BoundedQueue:
+    """Queue between two stages.
+
+    With drop_oldest the producer never waits: a full queue discards its oldest
+    item (a stale frame) to make room. Otherwise a full queue blocks the
+    producer, which is the back-pressure that keeps slow stages from being flooded.
+    """
+
+    def __init__(self, maxsize, drop_oldest=False):
+        self.queue = queue.Queue(maxsize)
+        self.drop_oldest = drop_oldest
+        self.dropped = 0
+
+    def put(self, item):
+        if item is STOP or not self.drop_oldest:
+            self.queue.put(item)
+            return
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    stale = self.queue.get_nowait()
+                except queue.Empty:
+                    continue
+                if stale is STOP:
+                    # Never drop the shutdown signal; keep it and discard the new item instead
+                    self.queue.put(stale)
+                    return
+                self.dropped += 1
+
+    def get(self, timeout=None):
+        return self.queue.get(timeout=timeout)
+
+    def qsize(self):
+        return self.queue.qsize()
+
+class Stage:
+    """One worker thread: takes items from inbox, applies func, passes non-None results on"""
+
+    def __init__(self, name, func, inbox, outbox=None):
+        self.name = name
+        self.func = func
+        self.inbox = inbox
+        self.outbox = outbox
+        self.processed = 0
+        self.busy_time = 0.0
+        self.started = None
+        self.thread = threading.Thread(target=self.run, name=f"stage-{name}", daemon=True)
+
+    def run(self):
+        self.started = time.perf_counter()
+        while True:
+            item = self.inbox.get() if self.inbox is not None else None
+            if item is STOP:
+                break
+            start = time.perf_counter()
+            try:
+                result = self.func(item)
+            except Exception as e:
+                logger.exception(f"Stage {self.name} failed: {e}")
+                result = None
+            elapsed = time.perf_counter() - start
+            self.busy_time += elapsed
+            self.processed += 1
+            METRICS.observe(f"stage_{self.name}_seconds", elapsed)
+            if result is STOP:
+                break
+            if result is not None and self.outbox is not None:
+                self.outbox.put(result)
+        if self.outbox is not None:
+            self.outbox.put(STOP)
+
+    def stats(self):
+        elapsed = time.perf_counter() - self.started if self.started else 0.0
+        return {
+            "stage": self.name,
+            "processed": self.processed,
+            "rate": self.processed / elapsed if elapsed else 0.0,
+            "busy": self.busy_time / elapsed if elapsed else 0.0,
+            "avg_time": self.busy_time / self.processed if self.processed else 0.0,
+            "queued": self.inbox.qsize() if self.inbox is not None else 0,
+            "dropped": self.inbox.dropped if self.inbox is not None else 0,
+        }
+
+class Pipeline:
+    """Stages connected by bounded queues; throughput is set by the slowest stage"""
+
+    def __init__(self):
+        self.stages = []
+
+    def add_stage(self, name, func, inbox=None, outbox=None):
+        stage = Stage(name, func, inbox, outbox)
+        self.stages.append(stage)
+        return stage
+
+    def start(self):
+        for stage in self.stages:
+            stage.thread.start()
+
+    def join(self, timeout=None):
+        for stage in self.stages:
+            stage.thread.join(timeout)
+
+    def stats_report(self):
+        lines = ["Pipeline stats:"]
+        for s in (stage.stats() for stage in self.stages):
+            lines.append(f"  {s['stage']:<10} {s['processed']:6d} items {s['rate']:7.2f}/s "
+                         f"avg {s['avg_time']:.3f}s busy {s['busy']:5.1%} queued {s['queued']} dropped {s['dropped']}")
+        return "\n".join(lines)
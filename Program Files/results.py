@@ -0,0 +1,39 @@
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class CardResults:
+    """Outcome and timing of every card, optionally written as JSON lines for comparing runs"""
+
+    def __init__(self, path=None):
+        self.file = open(path, 'w', encoding='utf-8') if path else None
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.cards = 0
+        self.recognized = 0
+        self.unsorted = 0
+        self.total_latency = 0.0
+
+    def record(self, **fields):
+        with self.lock:
+            self.cards += 1
+            self.recognized += fields.get("bin") not in (None, "RejectCard")
+            self.unsorted += fields.get("bin") is None
+            self.total_latency += fields.get("latency", 0.0)
+            if self.file is not None:
+                self.file.write(json.dumps({"card": self.cards, **fields}) + "\n")
+                self.file.flush()
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.start
+        average = self.total_latency / self.cards if self.cards else 0.0
+        rate = 60.0 * self.cards / elapsed if elapsed else 0.0
+        return (f"Cards: {self.cards} | Recognized: {self.recognized} | Unsorted: {self.unsorted} | Avg latency: {average:.3f}s | "
+                f"Elapsed: {elapsed:.1f}s | {rate:.1f} cards/min")
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
@@ -0,0 +1,126 @@
+import logging
+import queue
+import threading
+import time
+import serial
+
+logger = logging.getLogger(__name__)
+
+class SerialLink:
+    """Arduino connection served by a reader and a writer thread.
+
+    The reader collects whole <...> messages from buffered reads and sets the
+    ready event on "Arduino is ready". The writer sends queued commands one at
+    a time, each only once the machine reported ready, so the caller can go on
+    recognizing the next card while the current one is being moved. port is
+    anything serial.serial_for_url accepts, such as COM3, a pty path or loop://.
+    """
+
+    def __init__(self, port, baudrate, start_marker=b'<', end_marker=b'>', ready_text="Arduino is ready",
+                 queue_size=2, ready_timeout=30.0, on_message=None):
+        self.connection = serial.serial_for_url(port, baudrate, timeout=0.1)
+        self.start_marker = start_marker
+        self.end_marker = end_marker
+        self.ready_text = ready_text
+        self.ready_timeout = ready_timeout
+        self.on_message = on_message
+        self.ready = threading.Event()
+        self.closed = threading.Event()
+        self.commands = queue.Queue(queue_size)
+        self.buffer = bytearray()
+        self.sent = 0
+        self.received = 0
+        self.reader = threading.Thread(target=self._read_loop, name="serial-reader", daemon=True)
+        self.writer = threading.Thread(target=self._write_loop, name="serial-writer", daemon=True)
+
+    def start(self):
+        self.reader.start()
+        self.writer.start()
+        return self
+
+    def wait_ready(self, timeout=None):
+        """Block until the machine reports ready; False if timeout passed first"""
+        return self.ready.wait(timeout)
+
+    def send(self, command, timeout=None):
+        """Queue a command; blocks only while queue_size commands are already waiting"""
+        self.commands.put(command, timeout=timeout)
+
+    def drain(self, timeout=None):
+        """Wait until every queued command was sent and the machine is ready again"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.commands.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return self.wait_ready(None if deadline is None else max(0.0, deadline - time.monotonic()))
+
+    def close(self):
+        self.closed.set()
+        for thread in (self.reader, self.writer):
+            if thread.is_alive():
+                thread.join(1.0)
+        self.connection.close()
+
+    def _read_loop(self):
+        while not self.closed.is_set():
+            try:
+                data = self.connection.read(self.connection.in_waiting or 1)
+            except (serial.SerialException, OSError) as e:
+                if not self.closed.is_set():
+                    logger.error(f"Serial read failed: {e}")
+                return
+            if data:
+                self.buffer += data
+                self._parse()
+
+    def _parse(self):
+        while True:
+            start = self.buffer.find(self.start_marker)
+            # Text outside the markers (range readings, "Went to trayN") is only logged
+            text_end = start if start >= 0 else self.buffer.rfind(b'\n') + 1
+            if text_end > 0:
+                for line in bytes(self.buffer[:text_end]).decode('utf-8', errors='replace').splitlines():
+                    if line.strip():
+                        logger.debug(f"Arduino: {line.strip()}")
+                del self.buffer[:text_end]
+                continue
+            if start < 0:
+                return
+            end = self.buffer.find(self.end_marker, len(self.start_marker))
+            if end < 0:
+                return
+            message = bytes(self.buffer[len(self.start_marker):end]).decode('utf-8', errors='replace')
+            del self.buffer[:end + len(self.end_marker)]
+            self._handle(message)
+
+    def _handle(self, message):
+        self.received += 1
+        logger.info(f"Arduino: {message}")
+        if self.ready_text in message:
+            self.ready.set()
+        if self.on_message is not None:
+            self.on_message(message)
+
+    def _write_loop(self):
+        while not self.closed.is_set():
+            try:
+                command = self.commands.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            waited = time.monotonic()
+            warned = False
+            while not self.ready.wait(0.1):
+                if self.closed.is_set():
+                    return
+                if not warned and time.monotonic() - waited > self.ready_timeout:
+                    logger.warning(f"Arduino not ready after {self.ready_timeout:g}s, still waiting to send {command}")
+                    warned = True
+            self.ready.clear()
+            try:
+                self.connection.write(command.encode('utf-8'))
+                self.sent += 1
+            except (serial.SerialException, OSError) as e:
+                logger.error(f"Serial write of {command} failed: {e}")
+            finally:
+                self.commands.task_done()
@@ -0,0 +1,343 @@
+import argparse
+import json
+import logging
+import os
+import queue
+import random
+import select
+import sys
+import threading
+import time
+import tty
+
+logger = logging.getLogger(__name__)
+
+# Tray tables of Main8.ino: commands with reserved tray ranges and the trays they may use
+MATCHING_VALUES = ["RejectCard", "tray1", "tray7", "tray14", "tray18", "tray25", "tray26", "tray27", "tray28",
+                   "tray29", "tray30", "tray31", "tray32"]
+LOOP_START = [33, 1, 7, 14, 18, 25, 26, 27, 28, 29, 30, 31, 32]
+LOOP_END = [33, 6, 13, 17, 24, 25, 26, 27, 28, 29, 30, 31, 32]
+CALIBRATION_COMMANDS = {"CalibrateX1", "CalibrateX2", "CalibrateY1", "CalibrateY2"}
+TRAY_COUNT = 35
+
+# Injectable faults: a pickup retry (slow move), noise on the line, the ready
+# message arriving in pieces, and a ready message that never comes
+FAULTS = ("retry", "garbage", "split", "drop")
+
+class SorterSimulator:
+    """Software stand-in for the sorter running Main8.ino, served on a pseudo-terminal.
+
+    Commands are read the way Serial.readString does (until the line has been
+    quiet for read_timeout), assigned to trays like ForLoop, and answered with
+    "Went to trayN" and "<Arduino is ready>" after the move time. Times are in
+    machine seconds and multiplied by time_scale, so benchmarks can run faster
+    than the real machine.
+    """
+
+    def __init__(self, move_times=None, default_move_time=3.0, homing_time=6.0, homing_interval=10,
+                 read_timeout=1.0, tray_capacity=375, fault_rate=0.0, faults=FAULTS, time_scale=1.0, seed=None):
+        self.move_times = move_times or {}
+        self.default_move_time = default_move_time
+        self.homing_time = homing_time
+        self.homing_interval = homing_interval
+        self.read_timeout = read_timeout
+        self.tray_capacity = tray_capacity
+        self.fault_rate = fault_rate
+        self.faults = tuple(faults)
+        self.time_scale = time_scale
+        self.random = random.Random(seed)
+        self.assigned = [""] * TRAY_COUNT
+        self.assigned[33] = "RejectCard"
+        self.assigned[34] = "OverflowTray"
+        self.counts = [0] * TRAY_COUNT
+        self.moves = 0
+        self.commands = 0
+        self.fault_counts = {fault: 0 for fault in FAULTS}
+        self.stopped = False
+        self.closed = threading.Event()
+        self.master = None
+        self.slave = None
+        self.thread = None
+
+    @property
+    def port(self):
+        """Device path to open on the host side (SERIAL_PORT)"""
+        return os.ttyname(self.slave)
+
+    def start(self):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.thread = threading.Thread(target=self._run, name="sorter-simulator", daemon=True)
+        self.thread.start()
+        return self
+
+    def close(self):
+        self.closed.set()
+        if self.thread is not None:
+            self.thread.join(1.0)
+        for fd in (self.master, self.slave):
+            if fd is not None:
+                os.close(fd)
+
+    def _sleep(self, seconds):
+        self.closed.wait(seconds * self.time_scale)
+
+    def _write(self, text):
+        os.write(self.master, text.encode('utf-8'))
+
+    def _run(self):
+        self._write("Adafruit VL6180x test!\r\nSensor found!\r\n")
+        self._sleep(0.1)
+        self._write("<Arduino is ready>\r\n")
+        while not self.closed.is_set():
+            command = self._read_command()
+            if command and not self.stopped:
+                self._execute(command)
+
+    def _read_command(self):
+        """Like Serial.readString: collect bytes until the line has been quiet for read_timeout"""
+        data = b""
+        while not self.closed.is_set():
+            ready, _, _ = select.select([self.master], [], [], self.read_timeout * self.time_scale)
+            if ready:
+                try:
+                    data += os.read(self.master, 64)
+                except OSError:
+                    return None
+            elif data:
+                return data.decode('utf-8', errors='replace')
+            elif not self.stopped:
+                # Every idle pass of loop() prints a range reading
+                self._write(f"Range: {self.random.randint(35, 45)}\r\n")
+        return None
+
+    def _assign_tray(self, value, first, last):
+        """ForLoop of Main8.ino: the tray value goes to, None for no move, or -1 when the machine stops"""
+        for i in range(first, last + 1):
+            if self.assigned[i] == "":
+                self.assigned[i] = value
+            if self.assigned[i] == value and self.counts[i] <= self.tray_capacity:
+                return i
+            if i == 34:
+                return 34 if self.counts[34] < self.tray_capacity else -1
+        return None
+
+    def _execute(self, command):
+        self.commands += 1
+        fault = None
+        if self.faults and self.random.random() < self.fault_rate:
+            fault = self.random.choice(self.faults)
+            self.fault_counts[fault] += 1
+        if command in MATCHING_VALUES:
+            i = MATCHING_VALUES.index(command)
+            tray = self._assign_tray(command, LOOP_START[i], LOOP_END[i])
+        elif command in CALIBRATION_COMMANDS:
+            tray = None
+            self._sleep(0.1)
+        elif command == "HomeButton":
+            tray = None
+            self._sleep(self.homing_time)
+        else:
+            # The firmware's generic branch; every other bin shares trays 1-34
+            tray = self._assign_tray(command, 1, 34)
+        if tray == -1:
+            # StopMachine: every tray is full, the board hangs until it is reset
+            self.stopped = True
+            logger.warning("Simulated sorter stopped: overflow tray is full")
+            return
+        if tray is not None:
+            self.counts[tray] += 1
+            self.moves += 1
+            move_time = self.move_times.get(tray, self.default_move_time)
+            if fault == "retry":
+                move_time += self.random.uniform(0.5, 2.0)
+            self._sleep(move_time)
+            self._write(f"Went to tray{tray}\r\n")
+            if self.homing_interval and self.moves % self.homing_interval == 0:
+                self._sleep(self.homing_time)
+        if fault == "garbage":
+            self._write("\x00\xff<noise" + "".join(self.random.choice("<>#@!") for _ in range(5)) + "\r\n")
+        if fault == "drop":
+            return
+        if fault == "split":
+            self._write("<Arduino is")
+            self._sleep(0.05)
+            self._write(" ready>\r\n")
+        else:
+            self._write("<Arduino is ready>\r\n")
+
+def run_benchmark(cards=100, host_time=0.5, seed=0, **simulator_options):
+    """Sort cards through SerialLink against the simulator and measure machine-time throughput.
+
+    host_time is the recognition time per card on the host, in machine seconds,
+    so the overlap of recognition with the previous card's move shows up.
+    """
+    from seriallink import SerialLink
+    rng = random.Random(seed)
+    bins = MATCHING_VALUES + ["W", "U", "B", "R", "G", "Multicolor", "Colorless"]
+    simulator = SorterSimulator(seed=seed, **simulator_options).start()
+    time_scale = simulator.time_scale
+    link = SerialLink(simulator.port, 9600, ready_timeout=30.0 * time_scale).start()
+    try:
+        link.wait_ready()
+        start = time.perf_counter()
+        sent = 0
+        try:
+            for _ in range(cards):
+                time.sleep(host_time * time_scale)
+                # A dropped ready message stalls the queue for good, like on the real machine
+                link.send(rng.choice(bins), timeout=60.0 * time_scale)
+                sent += 1
+            drained = link.drain(timeout=60.0 * time_scale)
+        except queue.Full:
+            drained = False
+        elapsed = (time.perf_counter() - start) / time_scale
+    finally:
+        link.close()
+        simulator.close()
+    return {
+        "cards": sent,
+        "completed": drained,
+        "machine_seconds": elapsed,
+        "cards_per_minute": 60.0 * simulator.moves / elapsed if elapsed else 0.0,
+        "moves": simulator.moves,
+        "faults": simulator.fault_counts,
+    }
+
+def self_check(time_scale=0.01):
+    """Sort one card of each kind through SerialLink on the simulator's pty; returns the failures found.
+
+    Each command must be answered with "<Arduino is ready>" after the move,
+    and the card must land in the tray ForLoop picks: a reserved tray for a
+    matching value, the shared range for any other bin. "split" always
+    cuts the ready message in two, so the check also covers its framing.
+    """
+    from seriallink import SerialLink
+    expected = [("tray7", 7), ("RejectCard", 33), ("G", 1)]
+    failures = []
+    for faults in ((), ("split",)):
+        simulator = SorterSimulator(time_scale=time_scale, homing_interval=0, fault_rate=1.0 if faults else 0.0,
+                                    faults=faults, seed=0).start()
+        link = SerialLink(simulator.port, 9600, ready_timeout=30.0 * time_scale).start()
+        label = f"({', '.join(faults) or 'no faults'})"
+        try:
+            if not link.wait_ready(60.0 * time_scale):
+                failures.append(f"{label} no ready message after opening the port")
+                continue
+            for command, tray in expected:
+                link.send(command, timeout=60.0 * time_scale)
+                if not link.drain(timeout=60.0 * time_scale):
+                    failures.append(f"{label} {command}: no ready message after the move")
+                    break
+                if simulator.counts[tray] != 1:
+                    failures.append(f"{label} {command}: expected in tray {tray}, trays {simulator.counts}")
+            if link.received != 1 + len(expected) and not failures:
+                failures.append(f"{label} {link.received} ready messages received, expected {1 + len(expected)}")
+        finally:
+            link.close()
+            simulator.close()
+    return failures
+
+def feed_check():
+    """Feed the same card twice, back to back, through Main's sequential loop and its pipeline; returns the failures.
+
+    Identical cards from the stack lie at the same place and size, so each
+    must count as a new card once the one before was dispatched instead of
+    being taken for a card that never left.
+    """
+    import tempfile
+    import cv2
+    import numpy as np
+    from PIL import Image
+    import cards
+    import hashing
+    import Main
+    from cardstore import CardStore, build_card_store
+    from config import CROP_SIZE
+    from detection import find_card_contour, get_perspective_corrected_card
+    from framesource import ImageDirSource
+    from hashindex import HashIndex
+    from results import CardResults
+
+    rng = np.random.default_rng(0)
+    frame = np.full((1080, 1440, 3), 30, np.uint8)
+    frame[100:980, 400:1030] = 230
+    art = rng.integers(0, 255, (12, 9, 3), dtype=np.uint8)
+    frame[160:600, 440:990] = cv2.resize(art, (550, 440), interpolation=cv2.INTER_CUBIC)
+    warped = get_perspective_corrected_card(frame, find_card_contour(frame))
+    query = hashing.hash_query(Image.fromarray(cv2.cvtColor(warped[:CROP_SIZE, :CROP_SIZE], cv2.COLOR_BGR2RGB)))
+    card = {"id": "00000000-0000-0000-0000-000000000001", "name": "Grizzly Bears", "set": "tst", "colors": ["G"],
+            "color_identity": ["G"], "cmc": 2, "prices": {"usd": "0.10"}, "mana_cost": "{1}{G}",
+            "type_line": "Creature — Bear", "games": ["paper"], "lang": "en", "digital": False}
+    failures = []
+    Main.HEADLESS = True
+    with tempfile.TemporaryDirectory() as tmp:
+        images = os.path.join(tmp, "images")
+        os.makedirs(images)
+        for i in range(2):
+            cv2.imwrite(os.path.join(images, f"card{i}.png"), frame)
+        json_path = os.path.join(tmp, "default-cards.json")
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump([card], f)
+        build_card_store(json_path, os.path.join(tmp, "cards.sqlite"))
+        store = CardStore(os.path.join(tmp, "cards.sqlite"))
+        cards.CARD_STORE.set(store)
+        hashing.ACTIVE_INDEX.set(HashIndex([card["id"]], query[:, None, :]))
+        hashing.HASH_SEARCH.set(None)
+        try:
+            for run in (Main.run_sequential, Main.run_pipeline):
+                results = CardResults()
+                run(ImageDirSource(images, fed=True), "color", 1000000, "N", results)
+                if results.cards != 2:
+                    failures.append(f"{run.__name__}: {results.cards} of 2 identical cards fed back to back were sorted")
+        finally:
+            store.conn.close()
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated card sorter speaking the Main8.ino serial protocol")
+    parser.add_argument("--serve", action="store_true", help="Only serve the simulator and print its port")
+    parser.add_argument("--check", action="store_true",
+                        help="Check SerialLink against the simulator and the card tracker against cards fed back to back, "
+                             "and exit (1 on failure)")
+    parser.add_argument("--cards", type=int, default=100, help="Cards to sort in the benchmark")
+    parser.add_argument("--host-time", type=float, default=0.5, help="Host recognition time per card (s)")
+    parser.add_argument("--move-time", type=float, default=3.0, help="Move time per card (s)")
+    parser.add_argument("--tray-time", action="append", default=[], metavar="TRAY=SECONDS",
+                        help="Move time of one tray, may be repeated")
+    parser.add_argument("--read-timeout", type=float, default=1.0, help="Serial.readString timeout (s)")
+    parser.add_argument("--fault-rate", type=float, default=0.0, help="Probability of a fault per command")
+    parser.add_argument("--faults", default=",".join(FAULTS), help="Comma-separated faults to inject")
+    parser.add_argument("--time-scale", type=float, default=0.01, help="Wall seconds per machine second")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    options = {
+        "move_times": {int(tray): float(seconds) for tray, seconds in (item.split("=") for item in args.tray_time)},
+        "default_move_time": args.move_time,
+        "read_timeout": args.read_timeout,
+        "fault_rate": args.fault_rate,
+        "faults": [fault for fault in args.faults.split(",") if fault],
+    }
+    if args.check:
+        failures = self_check(args.time_scale) + feed_check()
+        for failure in failures:
+            print(f"FAIL {failure}")
+        print("Simulator check failed." if failures else "Simulator check passed.")
+        sys.exit(1 if failures else 0)
+    if args.serve:
+        simulator = SorterSimulator(**options).start()
+        print(f"Simulated sorter on {simulator.port} (set SERIAL_PORT to this). Ctrl+C to stop.")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            simulator.close()
+        return
+    result = run_benchmark(args.cards, args.host_time, time_scale=args.time_scale, **options)
+    print(f"Sent {result['cards']} cards in {result['machine_seconds']:.1f}s machine time: "
+          f"{result['cards_per_minute']:.1f} cards/min | moves {result['moves']} | faults {result['faults']}"
+          + ("" if result["completed"] else " | did not finish (dropped ready messages)"))
+
+if __name__ == "__main__":
+    main()
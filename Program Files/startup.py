@@ -0,0 +1,108 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PROCESS_START = time.perf_counter()
+RESOURCES = []
+PHASES = []
+# Resources whose loader is running on this thread, innermost last
+_LOADING = threading.local()
+
+class LazyResource:
+    """A heavy subsystem built on first use, or ahead of time in a background thread"""
+
+    def __init__(self, name, loader):
+        self.name = name
+        self.loader = loader
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.value = None
+        self.load_time = None
+        # Time the loader spent in other resources' get(), and the resource whose loader first needed this one
+        self.nested_time = 0.0
+        self.parent = None
+        self.error = None
+        self.thread = None
+        RESOURCES.append(self)
+
+    def get(self):
+        if not self.loaded:
+            stack = _LOADING.__dict__.setdefault("stack", [])
+            parent = stack[-1] if stack else None
+            start = time.perf_counter()
+            with self.lock:
+                if not self.loaded:
+                    stack.append(self)
+                    try:
+                        self.value = self.loader()
+                    finally:
+                        stack.pop()
+                    self.load_time = time.perf_counter() - start
+                    self.parent = parent
+                    self.loaded = True
+            if parent is not None:
+                # Loading (or waiting for) this resource is not the parent's own work
+                parent.nested_time += time.perf_counter() - start
+        return self.value
+
+    def self_time(self):
+        return max(0.0, self.load_time - self.nested_time)
+
+    def set(self, value):
+        """Install an already built value, e.g. a synthetic index for benchmarks"""
+        with self.lock:
+            self.value = value
+            self.load_time = 0.0
+            self.loaded = True
+
+    def warm_up(self):
+        """Start loading in a daemon thread; get() simply waits for it if still running"""
+        if not self.loaded and self.thread is None:
+            self.thread = threading.Thread(target=self._warm, name=f"warm-{self.name}", daemon=True)
+            self.thread.start()
+        return self
+
+    def _warm(self):
+        try:
+            self.get()
+        except Exception as e:
+            # Leave it unloaded so the foreground get() retries and raises where it is handled
+            self.error = e
+            logger.error(f"Background load of {self.name} failed: {e}")
+
+    def wait(self, timeout=None):
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+def warm_up(*resources):
+    for resource in resources:
+        resource.warm_up()
+
+def mark(phase):
+    """Record that a foreground startup phase (imports, prompts, camera) finished now"""
+    PHASES.append((phase, time.perf_counter() - PROCESS_START))
+
+def startup_report():
+    lines = ["Startup report:"]
+    previous = 0.0
+    for phase, elapsed in PHASES:
+        lines.append(f"  {phase:<24} {elapsed - previous:7.3f}s (at {elapsed:.3f}s)")
+        previous = elapsed
+    total = 0.0
+    for resource in RESOURCES:
+        if resource.loaded:
+            # Self time: resources loaded inside another's loader are not counted twice
+            total += resource.self_time()
+            state = f"{resource.self_time():7.3f}s" + (" (background)" if resource.thread else "")
+            if resource.parent is not None:
+                state += f" (inside {resource.parent.name})"
+        elif resource.error is not None:
+            state = f"failed: {resource.error}"
+        else:
+            state = "not loaded"
+        lines.append(f"  {resource.name:<24} {state}")
+    lines.append(f"  {'resources (total)':<24} {total:7.3f}s")
+    lines.append(f"  {'ready after':<24} {time.perf_counter() - PROCESS_START:7.3f}s")
+    return "\n".join(lines)